@@ -1,37 +1,20 @@
 #!/usr/bin/env python3
 
 import argparse
-import json
-import os
+import multiprocessing
 import statistics
 import sys
+from array import array
 from collections import defaultdict
 
-import trueskill
-
 import utility
+from multi_ranking import ONLINE_SYSTEMS, rate_online
 from pl_ranking import plackett_luce
-from ts_ranking import ts_ratings
-from wl_ranking import wl_bt_ratings, wl_pl_ratings
-
-def pl_rate(game_results):
-    return plackett_luce(game_results, tolerance=1e-09)
-
-def ts_rate(game_results):
-    return ts_ratings(game_results)
 
-def ts_t0_rate(game_results):
-    stau = trueskill.global_env().tau
-    trueskill.global_env().tau = 0
-    ratings = ts_ratings(game_results)
-    trueskill.global_env().tau = stau
-    return ratings
+PL_TOLERANCE = 1e-09
 
-def wl_bt_rate(game_results):
-    return wl_bt_ratings(game_results)
-
-def wl_pl_rate(game_results):
-    return wl_pl_ratings(game_results)
+def pl_rate(game_results):
+    return plackett_luce(game_results, tolerance=PL_TOLERANCE)
 
 def rank_order(ratings, a, b):
     return ratings[a] > ratings[b]
@@ -41,6 +24,29 @@ def ms_rank_order(ratings, a, b):
     br = ratings[b]
     return (ar.mu - (ar.sigma * 3)) > (br.mu - (br.sigma * 3))
 
+SYSTEMS = [
+        ("plackett-luce", {
+            "rate": pl_rate,
+            "order": rank_order,
+            }),
+        ("trueskill-default", {
+            "rater": ONLINE_SYSTEMS["ts"],
+            "order": ms_rank_order,
+            }),
+        ("trueskill-t0", {
+            "rater": ONLINE_SYSTEMS["ts-t0"],
+            "order": ms_rank_order,
+            }),
+        ("weng-lin-bt", {
+            "rater": ONLINE_SYSTEMS["wl-bt"],
+            "order": ms_rank_order,
+            }),
+        ("weng-lin-pl", {
+            "rater": ONLINE_SYSTEMS["wl-pl"],
+            "order": ms_rank_order,
+            }),
+        ]
+
 def check_predictions(test_results, ratings, order):
     num_wrong = 0
     num_predictions = 0
@@ -55,13 +61,11 @@ def check_predictions(test_results, ratings, order):
                 num_predictions += 1
     return num_wrong / num_predictions
 
-def load_parts(game_dir):
-    parts = list()
-    for gfile in os.listdir(game_dir):
-        if not gfile.endswith(".json"):
-            continue
-        gpath = os.path.join(game_dir, gfile)
-        parts.append(utility.load_games([gpath]))
+def load_parts(manifest_file, game_files, jobs=1):
+    manifest = utility.load_manifest(manifest_file)
+    store = utility.load_store(game_files, jobs)
+    views = utility.manifest_views(manifest, store)
+    parts = [views[name] for name in sorted(views)]
 
     max_part = max(len(p) for p in parts)
     min_part = min(len(p) for p in parts)
@@ -69,54 +73,102 @@ def load_parts(game_dir):
         print("WARNING: Partition size varies by %d games," % (max_part - min_part))
     num_games = sum(len(p) for p in parts)
     print("Loaded %d games in %d parts" % (num_games, len(parts)))
-    return parts
+    return store, parts
+
+def training_view(store, parts, test):
+    """View of the games in every part except test."""
+    indices = array('q', sorted(gix for p in parts if p is not test
+        for gix in p.indices))
+    return store.view(indices)
+
+def system_params(funcs):
+    """Parameters identifying a system's ratings in a RatingCache."""
+    if 'rater' in funcs:
+        rater = funcs['rater']()
+        return dict(rater.params(), system=rater.system)
+    return {"solver": plackett_luce.__name__, "tolerance": PL_TOLERANCE}
+
+def fold_errors(test, train, cache=None):
+    """Prediction error of each system trained on train and tested on test.
+    Ratings found in cache are reused and any others are added to it."""
+    ratings = dict()
+    keys = dict()
+    if cache:
+        digest = train.digest()
+        for system, funcs in SYSTEMS:
+            keys[system] = cache.key(digest, system, system_params(funcs))
+            cached = cache.get(keys[system])
+            if cached is not None:
+                print("Using cached %s ratings" % (system,))
+                ratings[system] = cached
+    # the online systems all share a single pass over the training games
+    raters = {system: funcs['rater']() for system, funcs in SYSTEMS
+            if 'rater' in funcs and system not in ratings}
+    if raters:
+        rate_online(train, list(raters.values()))
+    errors = list()
+    for system, funcs in SYSTEMS:
+        if system not in ratings:
+            if system in raters:
+                ratings[system] = raters[system].ratings()
+            else:
+                ratings[system] = funcs['rate'](train)
+            if cache:
+                cache.put(keys[system], ratings[system])
+        errors.append(check_predictions(test, ratings[system], funcs['order']))
+    return errors
+
+_worker_store = None
+_worker_cache = None
+
+def _init_worker(handle, cache_dir=None, cache_bytes=None):
+    global _worker_store, _worker_cache
+    _worker_store = utility.attach_store(handle)
+    if cache_dir:
+        _worker_cache = utility.RatingCache(cache_dir, cache_bytes)
+
+def _worker_fold_errors(indices):
+    test_ix, train_ix = indices
+    return fold_errors(_worker_store.view(test_ix), _worker_store.view(train_ix),
+            _worker_cache)
 
 def main(args=sys.argv[1:]):
     parser = argparse.ArgumentParser("Cross validate ratings on a set of partitioned games.")
-    parser.add_argument("game_dir",
-            help="Directory containing game files.")
+    parser.add_argument("manifest",
+            help="Partition manifest written by partition_games.")
+    parser.add_argument("game_files", nargs="+",
+            help="Json files containing the partitioned game data.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+            help="Number of folds to run in parallel worker processes.")
+    utility.add_cache_args(parser)
     config = parser.parse_args(args)
 
-    game_parts = load_parts(config.game_dir)
-
-    systems = [
-            ("plackett-luce", {
-                "rate": pl_rate,
-                "order": rank_order,
-                }),
-            ("trueskill-default", {
-                "rate": ts_rate,
-                "order": ms_rank_order,
-                }),
-            ("trueskill-t0", {
-                "rate": ts_t0_rate,
-                "order": ms_rank_order,
-                }),
-            ("weng-lin-bt", {
-                "rate": wl_bt_rate,
-                "order": ms_rank_order,
-                }),
-            ("weng-lin-pl", {
-                "rate": wl_pl_rate,
-                "order": ms_rank_order,
-                }),
-            ]
+    try:
+        store, game_parts = load_parts(config.manifest, config.game_files,
+                config.jobs)
+    except utility.ManifestError as err:
+        parser.error(str(err))
 
     error_rates = defaultdict(list)
-    for pnum, test in enumerate(game_parts, start=1):
-        test_results = [{"%s (%s)" % (u['username'], u['userID']): int(u['rank'])
-            for u in g['users']} for g in test]
-        train = [g for p in game_parts if p != test for g in p]
-        train.sort(key=lambda x: x['gameID'])
-        train_results = [{"%s (%s)" % (u['username'], u['userID']): int(u['rank'])
-            for u in g['users']} for g in train]
-        for system, funcs in systems:
-            ratings = funcs['rate'](train_results)
-            error_rates[system].append(
-                    check_predictions(test_results, ratings, funcs['order']))
+    folds = [(test, training_view(store, game_parts, test))
+            for test in game_parts]
+    if config.jobs > 1:
+        with utility.SharedGameStore(store) as shared:
+            with multiprocessing.Pool(config.jobs, _init_worker,
+                    (shared.handle, config.cache_dir,
+                        config.cache_size << 20)) as pool:
+                fold_results = pool.map(_worker_fold_errors,
+                        [(test.indices, train.indices) for test, train in folds])
+    else:
+        cache = utility.open_cache(config)
+        fold_results = (fold_errors(test, train, cache)
+                for test, train in folds)
+    for pnum, errors in enumerate(fold_results, start=1):
+        for (system, funcs), error in zip(SYSTEMS, errors):
+            error_rates[system].append(error)
             print("Finished %d parts for %-17s %.2f error" % (
-                pnum, system, error_rates[system][-1] * 100))
-    for system, funcs in systems:
+                pnum, system, error * 100))
+    for system, funcs in SYSTEMS:
         error = statistics.mean(error_rates[system])
         error_sd = statistics.stdev(error_rates[system])
         print("Prediction error for %-17s %.2f%% (%.2f%%)" % (
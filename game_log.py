@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+
+import argparse
+import bisect
+import hashlib
+import heapq
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+import utility
+
+"""
+Append-only log of games in a compact binary format.
+
+Daily game dumps overlap, so ingesting a dump only appends the games the
+log has not seen. A log directory holds:
+
+games.log      the game records, in the order they were ingested
+index.ids.N    sorted gameIDs of every record
+index.offs.N   byte offset of each record in games.log, matching index.ids.N
+bloom.bin.N    Bloom filter of the gameIDs, checked before the index
+meta.json      sizes, settings and the version N of the index files
+
+Each ingest writes the index and Bloom filter under a new version and then
+replaces meta.json, which is the commit point. An interrupted ingest leaves
+meta.json naming the previous, intact, version and the records past its
+log size are dropped by the next ingest.
+
+Readers find a starting gameID by bisecting the memory mapped index and
+read records in gameID order from there.
+
+Records keep only the gameID, workerID and each user's username, userID,
+rank and errorLogName, returned as strings like the json dumps. Any other
+fields in the dumps are not stored.
+"""
+
+HEADER = struct.Struct("<IqqH")  # record length, gameID, workerID, users
+USER = struct.Struct("<iHHH")  # rank, username, userID and errorLogName lengths
+NO_ERROR_LOG = 0xFFFF
+
+def encode_game(game):
+    gid = int(game['gameID'])
+    wid = game.get('workerID')
+    parts = list()
+    for user in game['users']:
+        name = user['username'].encode()
+        uid = str(user['userID']).encode()
+        error_log = user['errorLogName']
+        error_log = None if error_log is None else error_log.encode()
+        parts.append(USER.pack(int(user['rank']), len(name), len(uid),
+            NO_ERROR_LOG if error_log is None else len(error_log)))
+        parts += [name, uid, error_log or b""]
+    body = b"".join(parts)
+    return HEADER.pack(HEADER.size + len(body), gid,
+            -1 if wid is None else int(wid), len(game['users'])) + body
+
+def decode_game(buf, offset=0):
+    """Game dict in the json dump format from the record at offset."""
+    length, gid, wid, num_users = HEADER.unpack_from(buf, offset)
+    pos = offset + HEADER.size
+    users = list()
+    for _ in range(num_users):
+        rank, name_len, uid_len, log_len = USER.unpack_from(buf, pos)
+        pos += USER.size
+        name = bytes(buf[pos:pos + name_len]).decode()
+        pos += name_len
+        uid = bytes(buf[pos:pos + uid_len]).decode()
+        pos += uid_len
+        error_log = None
+        if log_len != NO_ERROR_LOG:
+            error_log = bytes(buf[pos:pos + log_len]).decode()
+            pos += log_len
+        users.append({"username": name, "userID": uid, "rank": str(rank),
+            "errorLogName": error_log})
+    return {"gameID": str(gid), "workerID": None if wid < 0 else str(wid),
+            "users": users}
+
+class BloomFilter:
+    """Bloom filter of integer keys, with k bit positions from one hash."""
+    def __init__(self, num_bits, num_hashes=7, bits=None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bits if bits is not None else bytearray((num_bits + 7) // 8)
+
+    def _positions(self, key):
+        h = hashlib.blake2b(struct.pack("<q", key), digest_size=16).digest()
+        h1, h2 = struct.unpack("<QQ", h)
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7))
+                for pos in self._positions(key))
+
+def _map_array(filename, typecode, length):
+    """Read only memory mapped array view of a file, empty if length is 0."""
+    if length == 0:
+        return array(typecode)
+    with open(filename, 'rb') as mfile:
+        mapped = mmap.mmap(mfile.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mapped).cast(typecode)[:length]
+
+def _write_atomic(filename, data):
+    tmp_name = filename + ".tmp"
+    with open(tmp_name, 'wb') as out:
+        out.write(data)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp_name, filename)
+
+class GameLog:
+    """An append-only game log directory. With create a new log is started
+    if the directory does not hold one, otherwise that is a ValueError."""
+    BITS_PER_GAME = 10
+
+    def __init__(self, directory, create=False):
+        self.directory = directory
+        meta_file = self.path("meta.json")
+        if not os.path.exists(meta_file):
+            if not create:
+                raise ValueError("%s is not a game log" % (directory,))
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(meta_file):
+            with open(meta_file) as mfile:
+                self.meta = json.load(mfile)
+            if self.meta['byteorder'] != sys.byteorder:
+                raise ValueError("Game log was written with %s byteorder" % (
+                    self.meta['byteorder'],))
+        else:
+            self.meta = {"games": 0, "log_size": 0, "bloom_bits": 0,
+                    "bloom_hashes": 7, "byteorder": sys.byteorder,
+                    "version": 0}
+        self._open_index()
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def index_path(self, name, version=None):
+        if version is None:
+            version = self.meta['version']
+        return self.path("%s.%d" % (name, version))
+
+    def _open_index(self):
+        num_games = self.meta['games']
+        self.ids = _map_array(self.index_path("index.ids"), 'q', num_games)
+        self.offsets = _map_array(self.index_path("index.offs"), 'q',
+                num_games)
+        self.bloom = None
+        if self.meta['bloom_bits']:
+            with open(self.index_path("bloom.bin"), 'rb') as bfile:
+                self.bloom = BloomFilter(self.meta['bloom_bits'],
+                        self.meta['bloom_hashes'], bytearray(bfile.read()))
+
+    def __len__(self):
+        return self.meta['games']
+
+    def __contains__(self, game_id):
+        game_id = int(game_id)
+        if self.bloom is None or game_id not in self.bloom:
+            return False
+        ix = bisect.bisect_left(self.ids, game_id)
+        return ix < len(self.ids) and self.ids[ix] == game_id
+
+    def ingest(self, games):
+        """Append the games not already in the log, returns the number
+        appended and the number skipped as duplicates."""
+        added = dict()
+        skipped = 0
+        with open(self.path("games.log"), 'ab') as log:
+            # drop anything appended by an ingest that did not finish
+            log.truncate(self.meta['log_size'])
+            offset = self.meta['log_size']
+            for game in games:
+                gid = int(game['gameID'])
+                if gid in added or gid in self:
+                    skipped += 1
+                    continue
+                record = encode_game(game)
+                log.write(record)
+                added[gid] = offset
+                offset += len(record)
+            log.flush()
+            os.fsync(log.fileno())
+        if added:
+            self._commit(added, offset)
+        return len(added), skipped
+
+    def _commit(self, added, log_size):
+        new = sorted(added.items())
+        merged = heapq.merge(zip(self.ids, self.offsets), new)
+        ids = array('q')
+        offsets = array('q')
+        for gid, offset in merged:
+            ids.append(gid)
+            offsets.append(offset)
+
+        num_games = len(ids)
+        bloom = self.bloom
+        if bloom is None or num_games * self.BITS_PER_GAME > bloom.num_bits:
+            # rebuild at twice the size needed so it is not rebuilt every time
+            bloom = BloomFilter(2 * num_games * self.BITS_PER_GAME,
+                    self.meta['bloom_hashes'])
+            for gid in ids:
+                bloom.add(gid)
+        else:
+            for gid, offset in new:
+                bloom.add(gid)
+
+        old_version = self.meta['version']
+        version = old_version + 1
+        _write_atomic(self.index_path("index.ids", version), ids.tobytes())
+        _write_atomic(self.index_path("index.offs", version),
+                offsets.tobytes())
+        _write_atomic(self.index_path("bloom.bin", version), bytes(bloom.bits))
+        meta = dict(self.meta, games=num_games, log_size=log_size,
+                bloom_bits=bloom.num_bits, version=version)
+        _write_atomic(self.path("meta.json"), json.dumps(meta).encode())
+        self.meta = meta
+        self.ids = self.offsets = None
+        self._open_index()
+        for name in ("index.ids", "index.offs", "bloom.bin"):
+            try:
+                os.remove(self.index_path(name, old_version))
+            except FileNotFoundError:
+                pass
+
+    def games(self, start_id=None):
+        """Iterate over the games in gameID order, from start_id on."""
+        if not len(self):
+            return
+        start = 0
+        if start_id is not None:
+            start = bisect.bisect_left(self.ids, int(start_id))
+        with open(self.path("games.log"), 'rb') as log:
+            buf = mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for ix in range(start, len(self)):
+                    yield decode_game(buf, self.offsets[ix])
+            finally:
+                buf.close()
+
+def ingest(args):
+    parser = argparse.ArgumentParser("Append new games from json files to a game log.")
+    parser.add_argument("log_dir",
+            help="Game log directory, created if needed.")
+    parser.add_argument("game_files", nargs="+",
+            help="Json files containing game data.")
+    config = parser.parse_args(args)
+
+    log = GameLog(config.log_dir, create=True)
+    for filename in config.game_files:
+        added, skipped = log.ingest(utility.iter_games([filename]))
+        print("%s: added %d games, skipped %d already logged" % (filename,
+            added, skipped))
+    print("%s holds %d games" % (config.log_dir, len(log)))
+
+def cat(args):
+    parser = argparse.ArgumentParser("Write games from a game log as json.")
+    parser.add_argument("log_dir",
+            help="Game log directory.")
+    parser.add_argument("-s", "--start-id", type=int,
+            help="First gameID to write.")
+    parser.add_argument("-o", "--out-file",
+            help="File to write, otherwise games are written to stdout.")
+    config = parser.parse_args(args)
+
+    try:
+        log = GameLog(config.log_dir)
+    except ValueError as err:
+        parser.error(str(err))
+    out = open(config.out_file, 'w') if config.out_file else sys.stdout
+    out.write("[")
+    for gnum, game in enumerate(log.games(config.start_id)):
+        if gnum:
+            out.write(",\n")
+        json.dump(game, out)
+    out.write("]\n")
+    if config.out_file:
+        out.close()
+
+def info(args):
+    parser = argparse.ArgumentParser("Summarize a game log.")
+    parser.add_argument("log_dir",
+            help="Game log directory.")
+    config = parser.parse_args(args)
+
+    try:
+        log = GameLog(config.log_dir)
+    except ValueError as err:
+        parser.error(str(err))
+    print("%d games, %d bytes of records" % (len(log), log.meta['log_size']))
+    if len(log):
+        print("gameIDs %d to %d" % (log.ids[0], log.ids[-1]))
+
+COMMANDS = {
+        "ingest": ingest,
+        "cat": cat,
+        "info": info,
+        }
+
+def main(args=sys.argv[1:]):
+    if not args or args[0] not in COMMANDS:
+        print("Usage: game_log.py {ingest,cat,info} ...")
+        return
+    COMMANDS[args[0]](args[1:])
+
+if __name__ == "__main__":
+    main()
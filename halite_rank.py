@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import argparse
+import importlib
+import sys
+import time
+
+start_time = time.perf_counter()
+
+# Subcommand name to the module whose main implements it and a description.
+# Modules are only imported when their subcommand is run.
+COMMANDS = {
+        "pl": ("pl_ranking", "Create Plackett-Luce ratings."),
+        "pl-ooc": ("pl_ooc", "Plackett-Luce ratings from on-disk ranking data."),
+        "pl-dist": ("pl_distributed", "Plackett-Luce ratings from distributed workers."),
+        "pl-whatif": ("pl_whatif", "Plackett-Luce rank changes with players or games removed."),
+        "pl-decay": ("pl_decay", "Time decayed Plackett-Luce ratings updated with new games."),
+        "ts": ("ts_ranking", "Create TrueSkill ratings."),
+        "wl": ("wl_ranking", "Create Weng-Lin ratings."),
+        "multi": ("multi_ranking", "Create ratings from several online systems in one pass."),
+        "stats": ("rating_stats", "Gather performance statistics for ratings."),
+        "simulate": ("match_sim", "Win probability matrices and simulated matches."),
+        "tournament": ("tournament_sim", "Measure rating convergence in simulated tournaments."),
+        "prequential": ("prequential", "Evaluate an online system in a single pass."),
+        "cv": ("cross_validate", "Cross validate ratings on partitioned games."),
+        "split": ("split_games", "Split games into training and test sets."),
+        "partition": ("partition_games", "Partition games for cross validation."),
+        "log": ("game_log", "Ingest games into an append-only game log."),
+        "random-order": ("random_order", "Test ratings from randomly ordered games."),
+        }
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser("halite-rank",
+            description="Rate and evaluate players from Halite game data.",
+            epilog="commands:\n" + "\n".join("  %-14s%s" % (name, desc)
+                for name, (module, desc) in COMMANDS.items()),
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--timing", action="store_true",
+            help="Report startup and total run time.")
+    parser.add_argument("command", choices=COMMANDS,
+            help="Command to run, see below.")
+    parser.add_argument("args", nargs=argparse.REMAINDER,
+            help="Arguments for the command, use '<command> -h' for help.")
+    config = parser.parse_args(args)
+
+    module = importlib.import_module(COMMANDS[config.command][0])
+    started = time.perf_counter()
+    if config.timing:
+        print("Startup took %.1f ms" % ((started - start_time) * 1000,))
+    module.main(config.args)
+    if config.timing:
+        print("%s took %.2f seconds" % (config.command,
+            time.perf_counter() - started))
+
+if __name__ == "__main__":
+    main()
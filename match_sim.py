@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+import argparse
+import sys
+
+import numpy
+
+from rating_stats import (load_pl_ratings, load_ts_ratings, pl_winp_matrix,
+        ts_winp_matrix, wl_winp_matrix)
+
+"""
+Pairwise win probability matrices and Monte Carlo simulation of matches
+between rated players.
+
+Matches are simulated for many matchups at once. A matchup is a row of
+player indices padded with -1, so matches of 2 to 6 players can be mixed.
+Plackett-Luce orders come from sorting log gamma plus Gumbel noise,
+TrueSkill and Weng-Lin orders from sorting Gaussian performances with
+variance sigma^2 + beta^2.
+"""
+
+def _finish_probs(scores, matchups, samples, sample_scores, rng,
+        batch_cells=1 << 22):
+    """Sample finishing orders from sample_scores(rng, size) noise added to
+    scores. Returns probs where probs[m, i, f] is the chance the player in
+    slot i of matchup m finishes in position f (0 is first)."""
+    matchups = numpy.asarray(matchups)
+    if matchups.ndim == 1:
+        matchups = matchups[None, :]
+    active = matchups >= 0
+    base = numpy.where(active, scores[numpy.maximum(matchups, 0)], -numpy.inf)
+    num_matches, width = matchups.shape
+    counts = numpy.zeros((num_matches, width, width))
+    batch = max(1, batch_cells // (num_matches * width))
+    slots = numpy.arange(width)
+    done = 0
+    while done < samples:
+        size = min(batch, samples - done)
+        perf = base + sample_scores(rng, (size, num_matches, width))
+        # position of each slot in the sorted order
+        order = numpy.argsort(-perf, axis=2)
+        places = numpy.empty_like(order)
+        numpy.put_along_axis(places, order,
+                numpy.broadcast_to(slots, order.shape), axis=2)
+        for place in range(width):
+            counts[:, :, place] += numpy.sum(places == place, axis=0)
+        done += size
+    probs = counts / samples
+    probs[~active] = 0
+    return probs
+
+def simulate_pl(gammas, matchups, samples=10000, rng=None):
+    """Finishing position probabilities of Plackett-Luce matches."""
+    rng = numpy.random.default_rng(rng)
+    scores = numpy.log(numpy.asarray(gammas, dtype=float))
+    return _finish_probs(scores, matchups, samples,
+            lambda rng, size: rng.gumbel(size=size), rng)
+
+def simulate_gaussian(mu, sigma, beta, matchups, samples=10000, rng=None):
+    """Finishing position probabilities of matches with Gaussian performances,
+    as in TrueSkill and Weng-Lin."""
+    rng = numpy.random.default_rng(rng)
+    mu = numpy.asarray(mu, dtype=float)
+    spread = numpy.sqrt(numpy.asarray(sigma, dtype=float) ** 2 + beta ** 2)
+    matchups = numpy.asarray(matchups)
+    if matchups.ndim == 1:
+        matchups = matchups[None, :]
+    scale = numpy.where(matchups >= 0, spread[numpy.maximum(matchups, 0)], 0)
+    return _finish_probs(mu, matchups, samples,
+            lambda rng, size: rng.standard_normal(size) * scale, rng)
+
+def find_player(players, name):
+    """Index of a player given by full result name or username."""
+    for pix, player in enumerate(players):
+        if player == name or player.rsplit(" (", 1)[0] == name:
+            return pix
+    raise ValueError("No rating for player %s" % (name,))
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser("Win probabilities and simulated matches from ratings.")
+    parser.add_argument("-r", "--ratings", required=True,
+            help="File with ratings of players.")
+    parser.add_argument("--type", choices=["ts", "wl"],
+            help="Type of ratings, ts=trueskill or wl=Weng-Lin.")
+    parser.add_argument("-k", "--top", type=int, default=0,
+            help="Write the win probability matrix of the top K players.")
+    parser.add_argument("-o", "--out-file",
+            help="File to write the win probability matrix to, otherwise it is printed.")
+    parser.add_argument("-m", "--match", action="append", default=[],
+            help="Comma separated players in a match to simulate, may be repeated.")
+    parser.add_argument("-n", "--samples", type=int, default=10000,
+            help="Number of times each match is simulated.")
+    parser.add_argument("--seed", type=int,
+            help="Random seed for the simulations.")
+    config = parser.parse_args(args)
+
+    with open(config.ratings) as rfile:
+        fnum = len(rfile.readline().split(","))
+    if fnum == 3:
+        ratings = load_pl_ratings(config.ratings)
+        players = list(ratings)
+        gammas = numpy.array([ratings[p] for p in players])
+        print("Loaded plackett-luce ratings for %d players." % (len(players),))
+    else:
+        if not config.type:
+            print("Rating type not given, use --type argument.")
+            return
+        import trueskill
+        env = trueskill.TrueSkill(draw_probability=0.)
+        ratings = load_ts_ratings(config.ratings)
+        players = list(ratings)
+        mu = numpy.array([ratings[p].mu for p in players])
+        sigma = numpy.array([ratings[p].sigma for p in players])
+        beta = env.beta if config.type == "ts" else 25/6
+        print("Loaded %s ratings for %d players." % (config.type, len(players)))
+
+    if config.top > 0:
+        top = slice(0, config.top)
+        if fnum == 3:
+            matrix = pl_winp_matrix(gammas[top])
+        elif config.type == "ts":
+            matrix = ts_winp_matrix(mu[top], sigma[top], env)
+        else:
+            matrix = wl_winp_matrix(mu[top], sigma[top])
+        names = players[top]
+        out = open(config.out_file, 'w') if config.out_file else sys.stdout
+        out.write(",".join([""] + names) + "\n")
+        for name, row in zip(names, matrix):
+            out.write(",".join([name] + ["%.6f" % (p,) for p in row]) + "\n")
+        if config.out_file:
+            out.close()
+            print("Wrote %dx%d win probabilities to %s" % (len(names),
+                len(names), config.out_file))
+
+    if config.match:
+        matches = [[find_player(players, name.strip())
+            for name in match.split(",")] for match in config.match]
+        width = max(len(m) for m in matches)
+        matchups = numpy.array([m + [-1] * (width - len(m)) for m in matches])
+        rng = numpy.random.default_rng(config.seed)
+        if fnum == 3:
+            probs = simulate_pl(gammas, matchups, config.samples, rng)
+        else:
+            probs = simulate_gaussian(mu, sigma, beta, matchups,
+                    config.samples, rng)
+        for match, mprobs in zip(matches, probs):
+            print("Match of %d players, finishing position chances:" % (
+                len(match),))
+            pwidth = max(len(players[pix]) for pix in match)
+            for slot, pix in enumerate(match):
+                print("  %*s %s" % (pwidth, players[pix], " ".join(
+                    "%5.1f%%" % (p * 100,) for p in mprobs[slot, :len(match)])))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import argparse
+import math
+import sys
+
+import trueskill
+
+import utility
+from ts_ranking import TSRater
+from wl_ranking import WLBTRater, WLPLRater
+
+ONLINE_SYSTEMS = {
+        "ts": lambda: TSRater(trueskill.TrueSkill()),
+        "ts-t0": lambda: TSRater(trueskill.TrueSkill(tau=0)),
+        "wl-bt": WLBTRater,
+        "wl-pl": WLPLRater,
+        }
+
+class RaterGroup:
+    """Several online raters updated together, for use with
+    utility.rate_games."""
+    def __init__(self, raters):
+        self.raters = raters
+        self.updates = [rater.update for rater in raters]
+        self.last_game_id = None
+
+    def update(self, game):
+        for update in self.updates:
+            update(game)
+
+    def ratings(self):
+        return [rater.ratings() for rater in self.raters]
+
+def rate_online(game_results, raters):
+    """Update every rater with each game in a single pass over the games."""
+    print("Rating with %d systems" % (len(raters),))
+    return utility.rate_games(RaterGroup(raters), game_results)
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser("Create ratings from several online rating systems in one pass.")
+    utility.add_game_args(parser)
+    parser.add_argument("-s", "--system", action="append",
+            choices=sorted(ONLINE_SYSTEMS),
+            help="Rating system to use, may be repeated. (Default all)")
+    parser.add_argument("-d", "--display", type=int, default=40,
+            help="Limit display of rating to top N (0 for all)")
+    parser.add_argument("-o", "--out-prefix",
+            help="If specified will write the full ratings to <prefix>-<system>.csv")
+    config = parser.parse_args(args)
+    utility.check_game_args(parser, config)
+
+    systems = config.system or sorted(ONLINE_SYSTEMS)
+
+    try:
+        game_results, _ = utility.load_results(config)
+    except utility.ManifestError as err:
+        parser.error(str(err))
+
+    raters = [ONLINE_SYSTEMS[system]() for system in systems]
+    rate_online(game_results, raters)
+
+    for system, rater in zip(systems, raters):
+        ratings = sorted(rater.ratings().items(),
+                key=lambda x: -(x[1].mu - (x[1].sigma*3)))
+
+        if config.out_prefix:
+            out_file = "%s-%s.csv" % (config.out_prefix, system)
+            with open(out_file, 'w') as out:
+                for rank, (player, rating) in enumerate(ratings, start=1):
+                    score = rating.mu - (rating.sigma * 3)
+                    out.write('%d,%s,%f,%r,%r\n' % (rank, player, score,
+                        rating.mu, rating.sigma))
+            print("Wrote %s ratings to %s" % (system, out_file))
+
+        if config.display > 0:
+            ratings = ratings[:config.display]
+
+        print("%s ratings:" % (system,))
+        rwidth = math.floor(math.log10(len(ratings))) + 1
+        pwidth = max(len(r[0]) for r in ratings)
+        for rank, (player, rating) in enumerate(ratings, start=1):
+            score = rating.mu - (rating.sigma * 3)
+            print("%*d: %*s %.2f (%.2f, %.2f)" % (rwidth, rank, pwidth, player,
+                score, rating.mu, rating.sigma))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import io
+import sys
+import time
+
+import numpy
+
+from pl_ranking import compact_rankings, pl_compact, pl_numpy
+
+"""
+Compare the time taken by pl_numpy and by pl_compact with increasing numbers
+of threads, on randomly generated Plackett-Luce rankings.
+"""
+
+def random_rankings(num_players, num_games, max_players=6, seed=0):
+    """Rankings of random games between players with lognormal skills."""
+    rng = numpy.random.default_rng(seed)
+    skills = rng.lognormal(0, 1, num_players)
+    sizes = rng.integers(2, max_players + 1, num_games)
+    rankings = list()
+    for size in sizes:
+        players = rng.choice(num_players, size, replace=False)
+        # sorting by log skill plus gumbel noise gives a Plackett-Luce order
+        noise = numpy.log(skills[players]) + rng.gumbel(size=size)
+        order = players[numpy.argsort(-noise)]
+        rankings.append({"p%d" % (p,): rank
+            for rank, p in enumerate(order, start=1)})
+    return rankings
+
+def timed(func, *args, **kwargs):
+    """Run func with its progress output hidden, return result and seconds."""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser("Benchmark the threaded Plackett-Luce solver against pl_numpy.")
+    parser.add_argument("-p", "--players", type=int, default=1000,
+            help="Number of players.")
+    parser.add_argument("-g", "--games", type=int, default=100000,
+            help="Number of games.")
+    parser.add_argument("-t", "--tolerance", type=float, default=1e-7,
+            help="Rating convergence tolerance.")
+    parser.add_argument("-c", "--chunk-size", type=int, default=20000,
+            help="Number of games in each chunk.")
+    parser.add_argument("-j", "--threads", type=int, action="append",
+            help="Thread count to time, may be repeated. (Default 1, 2, 4, 8)")
+    parser.add_argument("--skip-numpy", action="store_true",
+            help="Don't time pl_numpy, its dense matrices need a lot of memory.")
+    config = parser.parse_args(args)
+
+    rankings = random_rankings(config.players, config.games)
+    players, rows = compact_rankings(rankings)
+    print("%d games between %d players" % (len(rows), len(players)))
+
+    if not config.skip_numpy:
+        ratings, base = timed(pl_numpy, rankings, config.tolerance)
+        print("pl_numpy: %.2f seconds" % (base,))
+    else:
+        base = None
+    single = None
+    for threads in config.threads or [1, 2, 4, 8]:
+        gammas, seconds = timed(pl_compact, rows, len(players),
+                config.tolerance, chunk_size=config.chunk_size,
+                threads=threads)
+        if single is None:
+            single = seconds
+        line = "pl_compact %d threads: %.2f seconds, %.2fx single thread" % (
+                threads, seconds, single / seconds)
+        if base:
+            line += ", %.2fx pl_numpy" % (base / seconds,)
+        print(line)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import math
+import os
+import sys
+
+import numpy
+
+import utility
+from pl_ranking import (_ranking_row, add_convergence_args,
+        convergence_from_args, normalize_ratings, pl_chunk_wins, pl_compact,
+        pl_compact_ilsr)
+
+"""
+Plackett-Luce ratings with each game weighted down exponentially by age.
+
+Age is counted in games, after half_life newer games a game counts half as
+much. The compact ranking rows, their weights, the weighted win counts and
+each player's numbers of games and wins are kept between runs. Adding games
+rescales the existing weights and win counts, adds in the new games and
+re-solves starting from the previous ratings. Games whose weight falls
+below the prune level are dropped and subtracted from the counts, along
+with players left without any games.
+
+Only the bookkeeping is incremental. Every solver iteration still passes
+over all the games in the window, as the denominators depend on the
+current ratings. Starting from the previous ratings saves some iterations,
+about a fifth with minorization-maximization and little with iLSR, so an
+update costs nearly as much as solving the window from scratch.
+
+The state is saved as a single state.npz in the state directory, replaced
+atomically so the arrays always match the recorded last gameID.
+"""
+
+class DecayedPL:
+    """Decayed ranking rows, weights and win counts, per player game counts
+    and the last solved gammas, for games added in gameID order."""
+    def __init__(self, half_life=20000, prune=1e-3, width=6):
+        self.half_life = half_life
+        self.prune = prune
+        self.width = width
+        self.players = list()
+        self.player_ixs = dict()
+        self.rows = numpy.zeros((0, width), dtype=numpy.int32)
+        self.weights = numpy.zeros(0)
+        self.game_ids = numpy.zeros(0, dtype=numpy.int64)
+        self.wins = numpy.zeros(0)
+        # unweighted numbers of games played and won by each player
+        self.played = numpy.zeros(0, dtype=numpy.int64)
+        self.won = numpy.zeros(0, dtype=numpy.int64)
+        self.gammas = numpy.zeros(0)
+        self.last_game_id = None
+
+    def add_games(self, rankings, game_ids):
+        """Add games, which must be newer than any already added."""
+        if not rankings:
+            return
+        rows = numpy.array([_ranking_row(ranking, self.player_ixs,
+            self.players, self.width) for ranking in rankings],
+            dtype=numpy.int32)
+        num_players = len(self.players)
+
+        decay = 0.5 ** (len(rows) / self.half_life)
+        self.weights *= decay
+        self.wins *= decay
+        self.wins = numpy.concatenate([self.wins,
+            numpy.zeros(num_players - len(self.wins))])
+        # the new games decay with their own age within the batch
+        weights = 0.5 ** (numpy.arange(len(rows))[::-1] / self.half_life)
+        self.wins += pl_chunk_wins(rows, num_players, weights)
+        self.played = self.count(self.played, rows, num_players, 1)
+        self.won = self.count(self.won, rows, num_players, 1, wins=True)
+
+        self.rows = numpy.concatenate([self.rows, rows])
+        self.weights = numpy.concatenate([self.weights, weights])
+        self.game_ids = numpy.concatenate([self.game_ids,
+            numpy.array(game_ids, dtype=numpy.int64)])
+        self.last_game_id = int(self.game_ids[-1])
+
+        # new players start at the average rating
+        mean = (numpy.mean(self.gammas) if len(self.gammas)
+                else 1 / num_players)
+        self.gammas = numpy.concatenate([self.gammas,
+            numpy.full(num_players - len(self.gammas), mean)])
+        self.prune_games()
+
+    @staticmethod
+    def count(counts, rows, num_players, sign, wins=False):
+        """counts, extended to num_players, plus sign times the games played
+        or won by each player in rows."""
+        counts = numpy.concatenate([counts,
+            numpy.zeros(num_players - len(counts), dtype=numpy.int64)])
+        if wins:
+            added = pl_chunk_wins(rows, num_players).astype(numpy.int64)
+        else:
+            added = numpy.bincount(rows[rows >= 0], minlength=num_players)
+        return counts + sign * added
+
+    def prune_games(self):
+        """Drop games weighted below the prune level and the players left
+        without games."""
+        stale = self.weights < self.prune
+        if not numpy.any(stale):
+            return
+        num_players = len(self.players)
+        stale_rows = self.rows[stale]
+        self.wins -= pl_chunk_wins(stale_rows, num_players, self.weights[stale])
+        self.played = self.count(self.played, stale_rows, num_players, -1)
+        self.won = self.count(self.won, stale_rows, num_players, -1, wins=True)
+        # exact zeros for players left without wins, despite rounding
+        self.wins[self.won == 0] = 0
+        numpy.maximum(self.wins, 0, out=self.wins)
+        keep = ~stale
+        self.rows = self.rows[keep]
+        self.weights = self.weights[keep]
+        self.game_ids = self.game_ids[keep]
+        print("Pruned %d stale games, keeping %d" % (numpy.sum(stale),
+            len(self.rows)))
+
+        present = self.played > 0
+        if not numpy.all(present):
+            new_ixs = numpy.cumsum(present) - 1
+            self.rows = numpy.where(self.rows >= 0,
+                    new_ixs[self.rows], -1).astype(numpy.int32)
+            self.players = [p for p, kept in zip(self.players, present)
+                    if kept]
+            self.player_ixs = {p: pix for pix, p in enumerate(self.players)}
+            self.gammas = self.gammas[present]
+            self.wins = self.wins[present]
+            self.played = self.played[present]
+            self.won = self.won[present]
+            print("Dropped %d players without games, keeping %d" % (
+                numpy.sum(~present), len(self.players)))
+
+    def solve(self, tolerance, solver="mm", threads=1, convergence=None):
+        if solver == "ilsr":
+            self.gammas = pl_compact_ilsr(self.rows, len(self.players),
+                    tolerance, self.gammas, weights=self.weights,
+                    threads=threads, convergence=convergence)
+        else:
+            self.gammas = pl_compact(self.rows, len(self.players), tolerance,
+                    self.gammas, weights=self.weights, threads=threads,
+                    wins=self.wins, convergence=convergence)
+        return self.ratings()
+
+    def ratings(self):
+        """Ratings of the players with a game still weighted."""
+        return {self.players[pix]: float(self.gammas[pix])
+                for pix in numpy.flatnonzero((self.wins > 0)
+                    & (self.gammas > 0))}
+
+    @staticmethod
+    def exists(directory):
+        return os.path.exists(os.path.join(directory, "state.npz"))
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        meta = {
+                "half_life": self.half_life,
+                "prune": self.prune,
+                "width": self.width,
+                "last_game_id": self.last_game_id,
+                "players": self.players,
+                }
+        tmp_name = os.path.join(directory, "state.tmp.npz")
+        numpy.savez(tmp_name, rows=self.rows, weights=self.weights,
+                game_ids=self.game_ids, wins=self.wins, played=self.played,
+                won=self.won, gammas=self.gammas,
+                meta=numpy.array(json.dumps(meta)))
+        os.replace(tmp_name, os.path.join(directory, "state.npz"))
+
+    @classmethod
+    def load(cls, directory):
+        with numpy.load(os.path.join(directory, "state.npz")) as state:
+            meta = json.loads(str(state['meta']))
+            model = cls(meta['half_life'], meta['prune'], meta['width'])
+            for name in ("rows", "weights", "game_ids", "wins", "played",
+                    "won", "gammas"):
+                setattr(model, name, state[name])
+        model.players = meta['players']
+        model.player_ixs = {p: pix for pix, p in enumerate(model.players)}
+        model.last_game_id = meta['last_game_id']
+        return model
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser("Create time decayed Plackett-Luce ratings, updating saved state with new games.")
+    utility.add_game_args(parser)
+    parser.add_argument("-s", "--state",
+            help="Directory holding the decayed state, created or updated with the games after its last gameID. Updates re-solve over every game in the window, starting from the saved ratings.")
+    parser.add_argument("--half-life", type=float, default=20000,
+            help="Number of newer games after which a game's weight halves.")
+    parser.add_argument("--prune", type=float, default=1e-3,
+            help="Drop games weighted below this.")
+    parser.add_argument("--ilsr", action="store_true",
+            help="Solve with iLSR instead of minorization-maximization.")
+    parser.add_argument("-j", "--threads", type=int, default=1,
+            help="Number of threads processing chunks.")
+    parser.add_argument("-t", "--tolerance", type=float, default=1e-9,
+            help="Set rating convergance tolerance.")
+    parser.add_argument("-d", "--display", type=int, default=40,
+            help="Limit display of rating to top N (0 for all)")
+    parser.add_argument("-o", "--out-file",
+            help="If specified will write the full ratings to given filename")
+    add_convergence_args(parser)
+    config = parser.parse_args(args)
+    utility.check_game_args(parser, config)
+
+    try:
+        game_results, game_ids = utility.load_results(config, min_players=2)
+    except utility.ManifestError as err:
+        parser.error(str(err))
+
+    if config.state and DecayedPL.exists(config.state):
+        model = DecayedPL.load(config.state)
+        if model.half_life != config.half_life or model.prune != config.prune:
+            print("Using the saved half life %g and prune level %g" % (
+                model.half_life, model.prune))
+        new = [gnum for gnum, gid in enumerate(game_ids)
+                if gid > model.last_game_id]
+        print("Adding %d games after game %d to %d saved games" % (len(new),
+            model.last_game_id, len(model.rows)))
+        game_results = [game_results[g] for g in new]
+        game_ids = [game_ids[g] for g in new]
+    else:
+        model = DecayedPL(config.half_life, config.prune)
+    model.add_games(game_results, game_ids)
+    if not len(model.rows):
+        print("No games to rate.")
+        return
+
+    ratings = model.solve(config.tolerance, "ilsr" if config.ilsr else "mm",
+            config.threads, convergence_from_args(config))
+    if config.state:
+        model.save(config.state)
+
+    ratings = list(ratings.items())
+    ratings.sort(key=lambda x: -x[1])
+
+    if config.out_file:
+        ratings = normalize_ratings(ratings)
+        with open(config.out_file, 'w') as out:
+            for rank, (player, rating) in enumerate(ratings, start=1):
+                out.write('%d,%s,%r\n' % (rank, player, rating))
+
+    if config.display > 0:
+        ratings = ratings[:config.display]
+    ratings = normalize_ratings(ratings)
+
+    rwidth = math.floor(math.log10(len(ratings))) + 1
+    pwidth = max(len(r[0]) for r in ratings)
+    for rank, (player, rating) in enumerate(ratings, start=1):
+        print("%*d: %*s %.4f" % (rwidth, rank, pwidth, player, rating))
+
+if __name__ == "__main__":
+    main()
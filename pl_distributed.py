@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+import argparse
+import math
+import multiprocessing
+import sys
+import time
+from multiprocessing.connection import Client, Listener
+
+import numpy
+
+from pl_ranking import (Convergence, add_convergence_args,
+        convergence_from_args, normalize_ratings, pl_chunk_denoms,
+        pl_chunk_loglik, pl_chunk_wins, read_rankings)
+
+"""
+Plackett-Luce MM algorithm with the rankings sharded across worker processes.
+
+Every iteration the coordinator sends the current gammas to each worker,
+the workers return the denominators for their shard and the coordinator
+sums them to make the next gammas. Workers are either local processes
+connected by pipes or processes on any host connecting over TCP with
+"pl_distributed.py worker host:port --authkey key".
+"""
+
+def serve(conn, chunk_size=100000):
+    """Worker loop answering coordinator requests about one shard."""
+    rows = None
+    num_players = 0
+    while True:
+        msg = conn.recv()
+        cmd = msg[0]
+        if cmd == "rows":
+            rows, num_players = msg[1], msg[2]
+        elif cmd == "load":
+            directory, start, end = msg[1:]
+            players, all_rows = read_rankings(directory)
+            rows = all_rows[start:end]
+            num_players = len(players)
+        elif cmd == "wins":
+            wins = numpy.zeros(num_players)
+            for start in range(0, len(rows), chunk_size):
+                wins += pl_chunk_wins(numpy.asarray(rows[start:start+chunk_size]),
+                        num_players)
+            conn.send(wins)
+        elif cmd == "denoms":
+            gammas = msg[1]
+            denoms = numpy.zeros(num_players)
+            for start in range(0, len(rows), chunk_size):
+                denoms += pl_chunk_denoms(
+                        numpy.asarray(rows[start:start+chunk_size]), gammas)
+            conn.send(denoms)
+        elif cmd == "loglik":
+            gammas = msg[1]
+            loglik = 0.
+            for start in range(0, len(rows), chunk_size):
+                loglik += pl_chunk_loglik(
+                        numpy.asarray(rows[start:start+chunk_size]), gammas)
+            conn.send(loglik)
+        elif cmd == "stop":
+            conn.close()
+            return
+        else:
+            raise ValueError("Unknown request %s" % (cmd,))
+
+class LocalTransport:
+    """Workers in local processes connected with pipes."""
+    def __init__(self, num_workers, chunk_size=100000):
+        self.connections = list()
+        self.processes = list()
+        for _ in range(num_workers):
+            conn, child_conn = multiprocessing.Pipe()
+            proc = multiprocessing.Process(target=serve,
+                    args=(child_conn, chunk_size), daemon=True)
+            proc.start()
+            child_conn.close()
+            self.connections.append(conn)
+            self.processes.append(proc)
+
+    def close(self):
+        for conn in self.connections:
+            conn.send(("stop",))
+            conn.close()
+        for proc in self.processes:
+            proc.join()
+
+class TCPTransport:
+    """Workers that connect to the coordinator over TCP."""
+    def __init__(self, address, authkey, num_workers):
+        self.listener = Listener(address, authkey=authkey)
+        print("Waiting for %d workers on %s:%d" % ((num_workers,)
+            + self.listener.address))
+        self.connections = list()
+        for _ in range(num_workers):
+            self.connections.append(self.listener.accept())
+            print("Worker connected from %s:%d" % (
+                self.listener.last_accepted))
+
+    def close(self):
+        for conn in self.connections:
+            conn.send(("stop",))
+            conn.close()
+        self.listener.close()
+
+def shard_bounds(num_rows, num_shards):
+    """Start and end rows splitting rows into contiguous shards."""
+    bounds = numpy.linspace(0, num_rows, num_shards + 1).astype(int)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def send_rows(connections, rows, num_players):
+    """Give each worker its shard of the ranking rows."""
+    for conn, (start, end) in zip(connections,
+            shard_bounds(len(rows), len(connections))):
+        conn.send(("rows", numpy.asarray(rows[start:end]), num_players))
+
+def send_directory(connections, directory, num_rows):
+    """Have each worker read its shard from a write_rankings directory."""
+    for conn, (start, end) in zip(connections,
+            shard_bounds(num_rows, len(connections))):
+        conn.send(("load", directory, int(start), int(end)))
+
+def all_reduce(connections, msg, size):
+    """Send msg to every worker and sum their replies in worker order."""
+    for conn in connections:
+        conn.send(msg)
+    total = numpy.zeros(size)
+    for conn in connections:
+        total += conn.recv()
+    return total
+
+def pl_distributed(connections, num_players, tolerance, init_gammas=None,
+        convergence=None):
+    """MM algorithm over the shards held by the connected workers.
+    Converges to the same ratings as pl_compact, up to rounding in the
+    order the shard sums are added."""
+    if convergence is None:
+        convergence = Convergence(tolerance)
+    convergence.start()
+    wins = all_reduce(connections, ("wins",), num_players)
+    if init_gammas is not None:
+        gammas = numpy.array(init_gammas, dtype=float)
+    else:
+        gammas = numpy.ones(num_players) / num_players
+    while True:
+        denoms = all_reduce(connections, ("denoms", gammas), num_players)
+        _gammas = gammas
+        gammas = numpy.zeros(num_players)
+        numpy.divide(wins, denoms, out=gammas, where=denoms > 0)
+        gammas /= numpy.sum(gammas)
+        loglik = None
+        if convergence.needs_loglik:
+            for conn in connections:
+                conn.send(("loglik", gammas))
+            loglik = sum(conn.recv() for conn in connections)
+        if convergence.done(gammas, _gammas, loglik):
+            break
+    return gammas
+
+def parse_address(address):
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+def worker(args):
+    parser = argparse.ArgumentParser("Run a distributed Plackett-Luce worker.")
+    parser.add_argument("address",
+            help="host:port of the coordinator.")
+    parser.add_argument("--authkey", required=True,
+            help="Shared secret, must match the coordinator's.")
+    parser.add_argument("-c", "--chunk-size", type=int, default=100000,
+            help="Number of rankings processed at a time.")
+    parser.add_argument("--wait", type=float, default=60,
+            help="Seconds to keep retrying while the coordinator is not listening.")
+    config = parser.parse_args(args)
+
+    give_up = time.monotonic() + config.wait
+    while True:
+        try:
+            conn = Client(parse_address(config.address),
+                    authkey=config.authkey.encode())
+            break
+        except ConnectionRefusedError:
+            if time.monotonic() > give_up:
+                raise
+            time.sleep(0.5)
+    serve(conn, config.chunk_size)
+
+def rate(args):
+    parser = argparse.ArgumentParser("Create Plackett-Luce ratings using distributed workers.")
+    parser.add_argument("ranking_dir",
+            help="Directory of ranking data written by pl_ooc.py build.")
+    parser.add_argument("-w", "--workers", type=int, default=2,
+            help="Number of workers.")
+    parser.add_argument("-l", "--listen",
+            help="host:port to wait for TCP workers on, otherwise local worker processes are started.")
+    parser.add_argument("--authkey",
+            help="Shared secret TCP workers use to connect.")
+    parser.add_argument("--shared-data", action="store_true",
+            help="Workers read their shard from ranking_dir themselves instead of being sent it.")
+    parser.add_argument("-t", "--tolerance", type=float, default=1e-9,
+            help="Set rating convergance tolerance.")
+    parser.add_argument("-c", "--chunk-size", type=int, default=100000,
+            help="Number of rankings local workers process at a time.")
+    parser.add_argument("-d", "--display", type=int, default=40,
+            help="Limit display of rating to top N (0 for all)")
+    parser.add_argument("-o", "--out-file",
+            help="If specified will write the full ratings to given filename")
+    add_convergence_args(parser)
+    config = parser.parse_args(args)
+
+    players, rows = read_rankings(config.ranking_dir)
+    if config.listen:
+        if not config.authkey:
+            print("TCP workers require an --authkey.")
+            return
+        transport = TCPTransport(parse_address(config.listen),
+                config.authkey.encode(), config.workers)
+    else:
+        transport = LocalTransport(config.workers, config.chunk_size)
+    try:
+        if config.shared_data:
+            send_directory(transport.connections, config.ranking_dir, len(rows))
+        else:
+            send_rows(transport.connections, rows, len(players))
+        gammas = pl_distributed(transport.connections, len(players),
+                config.tolerance, convergence=convergence_from_args(config))
+    finally:
+        transport.close()
+
+    ratings = [(player, float(gamma)) for player, gamma in zip(players, gammas)]
+    ratings.sort(key=lambda x: -x[1])
+
+    if config.out_file:
+        ratings = normalize_ratings(ratings)
+        with open(config.out_file, 'w') as out:
+            for rank, (player, rating) in enumerate(ratings, start=1):
+                out.write('%d,%s,%r\n' % (rank, player, rating))
+
+    if config.display > 0:
+        ratings = ratings[:config.display]
+    ratings = normalize_ratings(ratings)
+
+    rwidth = math.floor(math.log10(len(ratings))) + 1
+    pwidth = max(len(r[0]) for r in ratings)
+    for rank, (player, rating) in enumerate(ratings, start=1):
+        print("%*d: %*s %.4f" % (rwidth, rank, pwidth, player, rating))
+
+COMMANDS = {
+        "rate": rate,
+        "worker": worker,
+        }
+
+def main(args=sys.argv[1:]):
+    if not args or args[0] not in COMMANDS:
+        print("Usage: pl_distributed.py {rate,worker} ...")
+        return
+    COMMANDS[args[0]](args[1:])
+
+if __name__ == "__main__":
+    main()
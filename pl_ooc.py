@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import argparse
+import math
+import sys
+
+import utility
+from pl_ranking import (add_convergence_args, convergence_from_args,
+        normalize_ratings, pl_ooc, write_rankings)
+
+"""
+Plackett-Luce ratings for game histories too large to hold in memory.
+
+The build command streams game files into compact ranking data on disk, the
+rate command then runs the MM algorithm reading that data a chunk at a time.
+"""
+
+def stream_rankings(game_files, excluded_players=(), no_error=False,
+        remove_suspect=False, dedup=False):
+    """Game results from the game files, one game at a time."""
+    excluded_players = set(excluded_players)
+    seen = set() if dedup else None
+    for game in utility.iter_games(game_files):
+        if seen is not None:
+            if int(game['gameID']) in seen:
+                continue
+            seen.add(int(game['gameID']))
+        if no_error and not utility.filter_error_games([game]):
+            continue
+        if remove_suspect and not utility.filter_suspect_games([game]):
+            continue
+        result = {utility.result_name(u): int(u['rank']) for u in game['users']
+                if u['username'] not in excluded_players}
+        #only include games with 2 or more non-excluded competitors
+        if len(result) > 1:
+            yield result
+
+def build(args):
+    parser = argparse.ArgumentParser("Write compact ranking data from game files.")
+    parser.add_argument("game_files", nargs="+",
+            help="Json files containing game data.")
+    parser.add_argument("-o", "--out-dir", required=True,
+            help="Directory to write the ranking data to.")
+    parser.add_argument("-x", "--exclude", action="append", default=[],
+            help="Exclude player")
+    parser.add_argument("--remove-suspect", action="store_true",
+            help="Filter out suspect games based on workerID.")
+    parser.add_argument("--no-error", action="store_true",
+            help="Filter out games that had bot errors.")
+    parser.add_argument("--dedup", action="store_true",
+            help="Skip repeated gameIDs, needed when game files overlap.")
+    parser.add_argument("-w", "--width", type=int, default=6,
+            help="Maximum number of players in a game.")
+    config = parser.parse_args(args)
+
+    rankings = stream_rankings(config.game_files, config.exclude,
+            config.no_error, config.remove_suspect, config.dedup)
+    players, num_rankings = write_rankings(config.out_dir, rankings,
+            config.width)
+    print("Wrote %d rankings of %d players to %s" % (num_rankings,
+        len(players), config.out_dir))
+
+def rate(args):
+    parser = argparse.ArgumentParser("Create Plackett-Luce ratings from compact ranking data.")
+    parser.add_argument("ranking_dir",
+            help="Directory written by the build command.")
+    parser.add_argument("-t", "--tolerance", type=float, default=1e-9,
+            help="Set rating convergance tolerance.")
+    parser.add_argument("-c", "--chunk-size", type=int, default=100000,
+            help="Number of rankings read from disk at a time.")
+    parser.add_argument("-j", "--threads", type=int, default=1,
+            help="Number of threads processing chunks.")
+    parser.add_argument("-d", "--display", type=int, default=40,
+            help="Limit display of rating to top N (0 for all)")
+    parser.add_argument("-o", "--out-file",
+            help="If specified will write the full ratings to given filename")
+    parser.add_argument("-p", "--previous-ratings",
+            help="If specified will read initial ratings from given filename")
+    add_convergence_args(parser)
+    config = parser.parse_args(args)
+
+    init_ratings = None
+    if config.previous_ratings:
+        init_ratings = dict()
+        with open(config.previous_ratings) as rfile:
+            for line in rfile:
+                rank, player, rating = line.split(",")
+                init_ratings[player.strip()] = float(rating)
+
+    ratings = pl_ooc(config.ranking_dir, config.tolerance, init_ratings,
+            config.chunk_size, config.threads, convergence_from_args(config))
+    ratings = list(ratings.items())
+    ratings.sort(key=lambda x: -x[1])
+
+    if config.out_file:
+        ratings = normalize_ratings(ratings)
+        with open(config.out_file, 'w') as out:
+            for rank, (player, rating) in enumerate(ratings, start=1):
+                out.write('%d,%s,%r\n' % (rank, player, rating))
+
+    if config.display > 0:
+        ratings = ratings[:config.display]
+    ratings = normalize_ratings(ratings)
+
+    rwidth = math.floor(math.log10(len(ratings))) + 1
+    pwidth = max(len(r[0]) for r in ratings)
+    for rank, (player, rating) in enumerate(ratings, start=1):
+        print("%*d: %*s %.4f" % (rwidth, rank, pwidth, player, rating))
+
+COMMANDS = {
+        "build": build,
+        "rate": rate,
+        }
+
+def main(args=sys.argv[1:]):
+    if not args or args[0] not in COMMANDS:
+        print("Usage: pl_ooc.py {build,rate} ...")
+        return
+    COMMANDS[args[0]](args[1:])
+
+if __name__ == "__main__":
+    main()
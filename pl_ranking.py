@@ -1,26 +1,22 @@
 #!/usr/bin/env python3
 
 import argparse
+import functools
+import importlib.util
 import json
 import math
+import os
 import sys
 import time
+from array import array
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
 import utility
 
-HAVE_NUMPY = False
-try:
-    import numpy
-    HAVE_NUMPY = True
-except ImportError:
-    pass
-
-try:
-    from choix import ilsr_rankings
-    HAVE_ILSR = True
-except ImportError:
-    pass
+# numpy is slow to import, so only check it is available here and import it
+# when first used.
+HAVE_NUMPY = importlib.util.find_spec("numpy") is not None
 
 
 """
@@ -34,7 +30,152 @@ Paper found at http://projecteuclid.org/download/pdf_1/euclid.aos/1079120141
 Original matlab code from paper is at
 http://sites.stat.psu.edu/~dhunter/code/btmatlab/
 """
-def pl_python(rankings, tolerance):
+class Convergence:
+    """Stopping rules shared by the Plackett-Luce solvers.
+
+    l2      L2 norm of the change in gammas is at most tolerance (the
+            original rule)
+    gamma   largest relative change of any normalized gamma is at most
+            tolerance
+    loglik  relative change in log-likelihood is at most tolerance
+    top     order of the top_n players is unchanged for stable iterations
+
+    The solver stops when any of the given rules fires, or after
+    max_iterations. Afterwards rule, iterations and elapsed tell what
+    stopped it and when.
+    """
+    RULES = ("l2", "gamma", "loglik", "top")
+
+    def __init__(self, tolerance=1e-9, rules=("l2",), top_n=40, stable=5,
+            max_iterations=None):
+        for rule in rules:
+            if rule not in self.RULES:
+                raise ValueError("Unknown convergence rule %s" % (rule,))
+        self.tolerance = tolerance
+        self.rules = tuple(rules)
+        self.top_n = top_n
+        self.stable = stable
+        self.max_iterations = max_iterations
+        self.start()
+
+    @property
+    def needs_loglik(self):
+        return "loglik" in self.rules
+
+    def start(self):
+        self.iterations = 0
+        self.rule = None
+        self.elapsed = 0.
+        self.start_time = self.last_time = time.perf_counter()
+        self.gdiff = math.inf
+        self.loglik = None
+        self.top = None
+        self.top_unchanged = 0
+
+    def _array_changes(self, gammas, previous):
+        """L2 change, largest relative change and top order of numpy
+        gamma arrays."""
+        import numpy
+        gdiff = float(numpy.linalg.norm(gammas - previous))
+        change = top = None
+        if "gamma" in self.rules:
+            g = gammas / numpy.sum(gammas)
+            p = previous / numpy.sum(previous)
+            rated = p > 0
+            change = float(numpy.max(numpy.abs(g[rated] - p[rated])
+                / p[rated], initial=0))
+        if "top" in self.rules:
+            num_top = min(self.top_n, len(gammas))
+            top = numpy.argpartition(-gammas, num_top - 1)[:num_top]
+            top = top[numpy.argsort(-gammas[top], kind="stable")].tolist()
+        return gdiff, change, top
+
+    def _list_changes(self, gammas, previous):
+        """_array_changes for gammas given as lists."""
+        gdiff = math.sqrt(sum((g - p) ** 2
+            for g, p in zip(gammas, previous)))
+        change = top = None
+        if "gamma" in self.rules:
+            gsum = sum(gammas)
+            psum = sum(previous)
+            change = max((abs(g / gsum - p / psum) / (p / psum)
+                for g, p in zip(gammas, previous) if p > 0), default=0)
+        if "top" in self.rules:
+            top = sorted(range(len(gammas)), key=lambda i: -gammas[i])
+            top = top[:self.top_n]
+        return gdiff, change, top
+
+    def done(self, gammas, previous, loglik=None, note=""):
+        """Record an iteration's gammas, given as numpy arrays or lists in
+        the same player order, returns True when the solver should stop."""
+        if hasattr(gammas, "dtype"):
+            gdiff, change, top = self._array_changes(gammas, previous)
+        else:
+            gdiff, change, top = self._list_changes(gammas, previous)
+        self.iterations += 1
+        pgdiff = self.gdiff
+        self.gdiff = gdiff
+        now = time.perf_counter()
+        print("%d %.2f seconds L2=%.2e%s" % (self.iterations,
+            now - self.last_time, self.gdiff, note))
+        if self.gdiff > pgdiff:
+            print("Gamma difference increased, %.4e %.4e" % (self.gdiff, pgdiff))
+        self.last_time = now
+
+        fired = list()
+        if "l2" in self.rules and self.gdiff <= self.tolerance:
+            fired.append("l2")
+        if "gamma" in self.rules and change <= self.tolerance:
+            fired.append("gamma")
+        if "loglik" in self.rules:
+            if (self.loglik is not None and abs(loglik - self.loglik)
+                    <= self.tolerance * abs(self.loglik)):
+                fired.append("loglik")
+            self.loglik = loglik
+        if "top" in self.rules:
+            if top == self.top:
+                self.top_unchanged += 1
+            else:
+                self.top_unchanged = 0
+            self.top = top
+            if self.top_unchanged >= self.stable:
+                fired.append("top")
+        if self.max_iterations and self.iterations >= self.max_iterations:
+            fired.append("max-iterations")
+        if not fired:
+            return False
+        self.rule = fired[0]
+        self.elapsed = now - self.start_time
+        print("Stopped by the %s rule after %d iterations in %.2f seconds" % (
+            self.rule, self.iterations, self.elapsed))
+        return True
+
+def add_convergence_args(parser):
+    parser.add_argument("--stop", action="append", choices=Convergence.RULES,
+            help="Convergence rule, stopping when any given rule fires, may be repeated. (Default l2)")
+    parser.add_argument("--top-n", type=int, default=40,
+            help="Number of top players the top rule watches.")
+    parser.add_argument("--stable", type=int, default=5,
+            help="Iterations the top N order must be unchanged for the top rule.")
+    parser.add_argument("--max-iterations", type=int,
+            help="Stop after this many iterations.")
+
+def convergence_from_args(config):
+    return Convergence(config.tolerance, config.stop or ("l2",), config.top_n,
+            config.stable, config.max_iterations)
+
+def rankings_loglik(rankings, gammas):
+    """Plackett-Luce log-likelihood of rankings given a dict of gammas."""
+    loglik = 0.
+    for ranking in rankings:
+        order = sorted(ranking, key=ranking.get)
+        remaining = sum(gammas[p] for p in order)
+        for player in order[:-1]:
+            loglik += math.log(gammas[player]) - math.log(remaining)
+            remaining -= gammas[player]
+    return loglik
+
+def pl_python(rankings, tolerance, init_ratings=None, convergence=None):
     ''' Returns dictionary containing player : plackett_luce_parameter keys
     and values. This algorithm requires that the set of players be unable to be
     split into two disjoint sets where nobody from set A has beaten anyone from
@@ -43,14 +184,16 @@ def pl_python(rankings, tolerance):
     individual ranking and contains the player : finish for that ranking.
     The plackett_luce parameters returned are un-normalized and can be
     normalized by the calling function if desired.'''
-    players = set(key for ranking in rankings for key in ranking.keys())
+    if convergence is None:
+        convergence = Convergence(tolerance)
+    convergence.start()
+    players = list(set(key for ranking in rankings for key in ranking.keys()))
     ws = Counter(name for ranking in rankings for name, finish in ranking.items() if finish < max(ranking.values()))
-    gammas = {player : 1.0 / len(players) for player in players}
-    _gammas = {player : 0 for player in players}
-    gdiff = 10
-    iteration = 0
-    start = time.perf_counter()
-    while gdiff > tolerance:
+    if init_ratings:
+        gammas = {player : init_ratings.get(player, 1.0 / len(players)) for player in players}
+    else:
+        gammas = {player : 1.0 / len(players) for player in players}
+    while True:
         denoms = {player : sum(sum(0 if ranking.get(player,-1) < place else
             1 / sum(gammas[finisher] for finisher, finish in ranking.items() if finish >= place)
             for place in sorted(ranking.values())[:-1])
@@ -58,20 +201,19 @@ def pl_python(rankings, tolerance):
 
         _gammas = gammas
         gammas = {player : ws[player] / denoms[player] for player in players}
-        pgdiff = gdiff
-        gdiff = math.sqrt(sum((gamma - _gammas[player]) ** 2 for player, gamma in gammas.items()))
-        iteration += 1
-        now = time.perf_counter()
-        print("%d %.2f seconds L2=%.2e" % (iteration, now-start, gdiff))
-        if gdiff > pgdiff:
-            print("Gamma difference increased, %.4e %.4e" % (gdiff, pgdiff))
-        start = now
+        loglik = None
+        if convergence.needs_loglik:
+            loglik = rankings_loglik(rankings, gammas)
+        if convergence.done([gammas[p] for p in players],
+                [_gammas[p] for p in players], loglik):
+            break
     return gammas
 plackett_luce = pl_python
 
-def pl_numpy(rankings, tolerance, init_ratings=None):
+def pl_numpy(rankings, tolerance, init_ratings=None, convergence=None):
     """ Numpy implementation based directly off of the original matlab code.
     """
+    import numpy
     players = list(set(key for ranking in rankings for key in ranking.keys()))
 
     ws = Counter(name for ranking in rankings for name, finish in ranking.items() if finish < max(ranking.values()))
@@ -92,11 +234,13 @@ def pl_numpy(rankings, tolerance, init_ratings=None):
         gammas = numpy.array([init_ratings[player] for player in players])
     else:
         gammas = numpy.ones((M)) / M
-    gdiff = 1
-    iterations = 0
-    start = time.perf_counter()
-    while gdiff > tolerance:
-        iterations += 1
+    if convergence is None:
+        convergence = Convergence(tolerance)
+    convergence.start()
+    if convergence.needs_loglik:
+        row_players, rows = compact_rankings(rankings)
+        row_players = numpy.array([players.index(p) for p in row_players])
+    while True:
         g = (f > 0).choose(0, gammas[f - 1].squeeze())
         g = numpy.cumsum(g[::-1,:],axis=0)[::-1,:]   #reverse vertical cumsum
         g[pp - 1, numpy.arange(numpy.shape(g)[1])] = 0
@@ -107,35 +251,414 @@ def pl_numpy(rankings, tolerance, init_ratings=None):
         gammas = w / numpy.sum(r2,axis=1)
         normalization_constant = numpy.sum(gammas)
         gammas = gammas / normalization_constant
-        pgdiff = gdiff
-        gdiff = numpy.linalg.norm(gammas - _gammas)
-        now = time.perf_counter()
-        print("%d %.2f seconds L2=%.2e" % (iterations, now-start, gdiff))
-        if gdiff > pgdiff:
-            print("Gamma difference increased, %.4e %.4e" % (gdiff, pgdiff))
-        start = now
+        loglik = None
+        if convergence.needs_loglik:
+            loglik = pl_chunk_loglik(numpy.asarray(rows), gammas[row_players])
+        if convergence.done(gammas, _gammas, loglik):
+            break
 
-    return {player : gamma for player, gamma in zip(players, gammas)}
+    return {player : float(gamma) for player, gamma in zip(players, gammas)}
 if HAVE_NUMPY:
     plackett_luce = pl_numpy
 
-def pl_ilsr(rankings, tolerance, init_ratings=None):
-    players = list(set(key for ranking in rankings for key in ranking.keys()))
-    player_ixs = {player: ix for ix, player in enumerate(players)}
-    data = list()
+def _ranking_row(ranking, player_ixs, players, width):
+    """Player indices of a ranking in finishing order padded with -1."""
+    ranked = sorted(ranking, key=ranking.get)
+    if len(ranked) > width:
+        raise ValueError("Ranking with %d players is wider than %d" % (
+            len(ranked), width))
+    row = list()
+    for player in ranked:
+        pix = player_ixs.get(player)
+        if pix is None:
+            pix = len(players)
+            players.append(player)
+            player_ixs[player] = pix
+        row.append(pix)
+    return row + [-1] * (width - len(row))
+
+def compact_rankings(rankings, width=None):
+    """Convert rankings to a list of players and a matrix with one row of
+    player indices per ranking, see _ranking_row."""
+    import numpy
+    if width is None:
+        width = max(len(ranking) for ranking in rankings)
+    players = list()
+    player_ixs = dict()
+    rows = numpy.array([_ranking_row(ranking, player_ixs, players, width)
+        for ranking in rankings], dtype=numpy.int32).reshape(-1, width)
+    return players, rows
+
+def write_rankings(directory, rankings, width=6, chunk_size=100000):
+    """Write rankings to directory in the compact_rankings format without
+    holding them all in memory."""
+    os.makedirs(directory)
+    players = list()
+    player_ixs = dict()
+    num_rankings = 0
+    with open(os.path.join(directory, "rankings.i32"), 'wb') as rfile:
+        buf = array('i')
+        for ranking in rankings:
+            buf.extend(_ranking_row(ranking, player_ixs, players, width))
+            num_rankings += 1
+            if num_rankings % chunk_size == 0:
+                buf.tofile(rfile)
+                buf = array('i')
+        buf.tofile(rfile)
+    with open(os.path.join(directory, "players.txt"), 'w') as pfile:
+        for player in players:
+            pfile.write(player + "\n")
+    with open(os.path.join(directory, "meta.json"), 'w') as mfile:
+        json.dump({
+            "width": width,
+            "rankings": num_rankings,
+            "byteorder": sys.byteorder,
+            }, mfile)
+    return players, num_rankings
+
+def read_rankings(directory):
+    """Get the players and a memory mapped rankings matrix written by
+    write_rankings."""
+    import numpy
+    with open(os.path.join(directory, "meta.json")) as mfile:
+        meta = json.load(mfile)
+    with open(os.path.join(directory, "players.txt")) as pfile:
+        players = [line.rstrip("\n") for line in pfile]
+    dtype = numpy.dtype(numpy.int32).newbyteorder(
+            "<" if meta['byteorder'] == "little" else ">")
+    rows = numpy.memmap(os.path.join(directory, "rankings.i32"), dtype=dtype,
+            mode='r', shape=(meta['rankings'], meta['width']))
+    return players, rows
+
+def _chunk_positions(rows):
+    """Masks of the occupied positions in each row and of the positions
+    that are not the last occupied one, i.e. the player beat the rest."""
+    import numpy
+    active = rows >= 0
+    remaining = numpy.cumsum(active[:, ::-1], axis=1)[:, ::-1]
+    return active, active & (remaining > 1)
+
+def pl_chunk_wins(rows, num_players, weights=None):
+    """Number of times each player finished ahead of the rest of a ranking."""
+    import numpy
+    active, won = _chunk_positions(rows)
+    counts = won if weights is None else won * weights[:, None]
+    return numpy.bincount(rows[won], weights=counts[won],
+            minlength=num_players)
+
+def pl_chunk_denoms(rows, gammas, weights=None):
+    """A chunk of rankings contribution to the MM update denominators.
+
+    Same calculation as pl_numpy on the compact ranking rows, each position
+    that was won adds 1 / (sum of gammas still in the ranking) to every
+    player still in the ranking.
+    """
+    import numpy
+    active, won = _chunk_positions(rows)
+    g = numpy.where(active, gammas[rows], 0)
+    remaining = numpy.cumsum(g[:, ::-1], axis=1)[:, ::-1]
+    inv = numpy.zeros_like(remaining)
+    numpy.divide(1, remaining, out=inv, where=won)
+    terms = numpy.cumsum(inv, axis=1)
+    if weights is not None:
+        terms *= weights[:, None]
+    return numpy.bincount(rows[active], weights=terms[active],
+            minlength=len(gammas))
+
+def pl_chunk_loglik(rows, gammas, weights=None):
+    """A chunk of rankings contribution to the log-likelihood."""
+    import numpy
+    active, won = _chunk_positions(rows)
+    g = numpy.where(active, gammas[rows], 0)
+    remaining = numpy.cumsum(g[:, ::-1], axis=1)[:, ::-1]
+    terms = numpy.zeros_like(remaining)
+    valid = won & (g > 0)
+    terms[valid] = numpy.log(g[valid]) - numpy.log(remaining[valid])
+    if weights is not None:
+        terms *= weights[:, None]
+    return float(numpy.sum(terms))
+
+def pl_compact(rows, num_players, tolerance, init_gammas=None,
+        chunk_size=100000, weights=None, threads=1, wins=None,
+        convergence=None):
+    """MM algorithm over compact ranking rows, processed chunk_size rows at
+    a time. rows may be a memory mapped array, so only one chunk needs to
+    be in memory at once. With threads > 1 the chunks are spread over a
+    thread pool, numpy releases the GIL in the chunk calculations. The
+    partial sums are always added in chunk order so the result does not
+    depend on the number of threads. wins may be given when the caller
+    already keeps the (weighted) win counts. convergence decides when to
+    stop, by default the L2 rule with tolerance. Returns the normalized
+    gamma array.
+    """
+    import numpy
+    chunks = [(start, min(start + chunk_size, len(rows)))
+            for start in range(0, len(rows), chunk_size)]
+    def chunk(bounds):
+        start, end = bounds
+        crows = numpy.asarray(rows[start:end])
+        cweights = None if weights is None else numpy.asarray(weights[start:end])
+        return crows, cweights
+    def chunk_wins(bounds):
+        crows, cweights = chunk(bounds)
+        return pl_chunk_wins(crows, num_players, cweights)
+    def chunk_denoms(bounds, gammas):
+        crows, cweights = chunk(bounds)
+        return pl_chunk_denoms(crows, gammas, cweights)
+    def chunk_loglik(bounds, gammas):
+        crows, cweights = chunk(bounds)
+        return pl_chunk_loglik(crows, gammas, cweights)
+
+    if convergence is None:
+        convergence = Convergence(tolerance)
+    convergence.start()
+    pool = ThreadPoolExecutor(threads) if threads > 1 else None
+    pmap = pool.map if pool else map
+    try:
+        if wins is None:
+            wins = numpy.zeros(num_players)
+            for partial in pmap(chunk_wins, chunks):
+                wins += partial
+
+        if init_gammas is not None:
+            gammas = numpy.array(init_gammas, dtype=float)
+        else:
+            gammas = numpy.ones(num_players) / num_players
+        while True:
+            denoms = numpy.zeros(num_players)
+            for partial in pmap(chunk_denoms, chunks, [gammas] * len(chunks)):
+                denoms += partial
+            _gammas = gammas
+            gammas = numpy.zeros(num_players)
+            numpy.divide(wins, denoms, out=gammas, where=denoms > 0)
+            gammas /= numpy.sum(gammas)
+            loglik = None
+            if convergence.needs_loglik:
+                loglik = sum(pmap(chunk_loglik, chunks, [gammas] * len(chunks)))
+            if convergence.done(gammas, _gammas, loglik):
+                break
+    finally:
+        if pool:
+            pool.shutdown()
+    return gammas
+
+def pl_chunked(rankings, tolerance, init_ratings=None, chunk_size=100000,
+        threads=1, convergence=None):
+    """In memory version of pl_ooc."""
+    players, rows = compact_rankings(rankings)
+    init_gammas = None
+    if init_ratings:
+        init_gammas = [init_ratings.get(p, 1 / len(players)) for p in players]
+    gammas = pl_compact(rows, len(players), tolerance, init_gammas, chunk_size,
+            threads=threads, convergence=convergence)
+    return {player: float(gamma) for player, gamma in zip(players, gammas)}
+
+def pl_ooc(directory, tolerance, init_ratings=None, chunk_size=100000,
+        threads=1, convergence=None):
+    """Plackett-Luce ratings for rankings saved by write_rankings, reading
+    them from disk a chunk at a time on every iteration. Gives the same
+    result as pl_chunked on the same rankings with the same chunk_size."""
+    players, rows = read_rankings(directory)
+    init_gammas = None
     if init_ratings:
-        ratings = [init_ratings.get(p, 1 / len(players)) for p in players]
+        init_gammas = [init_ratings.get(p, 1 / len(players)) for p in players]
+    gammas = pl_compact(rows, len(players), tolerance, init_gammas, chunk_size,
+            threads=threads, convergence=convergence)
+    return {player: float(gamma) for player, gamma in zip(players, gammas)}
+
+def _chunk_pairs(rows):
+    """Positions of the winner and loser of each pairwise comparison in a
+    row, with a mask of the comparisons where both positions are occupied."""
+    import numpy
+    win_pos, lose_pos = numpy.triu_indices(rows.shape[1], 1)
+    active = rows >= 0
+    return win_pos, lose_pos, active[:, win_pos] & active[:, lose_pos]
+
+def pl_chunk_pair_keys(rows, num_players):
+    """Sorted unique loser * num_players + winner keys of a chunk's
+    comparisons, the transitions of the spectral ranking Markov chain."""
+    import numpy
+    win_pos, lose_pos, valid = _chunk_pairs(rows)
+    keys = (rows[:, lose_pos].astype(numpy.int64) * num_players
+            + rows[:, win_pos])
+    return numpy.unique(keys[valid])
+
+def pl_chunk_rates(rows, gammas, pair_keys, weights=None):
+    """A chunk of rankings contribution to the chain transition rates.
+
+    Each comparison moves from the loser to the winner at rate
+    1 / (sum of gammas still in the ranking when the winner was chosen),
+    summed here into the position of its key in pair_keys.
+    """
+    import numpy
+    num_players = len(gammas)
+    win_pos, lose_pos, valid = _chunk_pairs(rows)
+    active, won = _chunk_positions(rows)
+    g = numpy.where(active, gammas[rows], 0)
+    remaining = numpy.cumsum(g[:, ::-1], axis=1)[:, ::-1]
+    inv = numpy.zeros_like(remaining)
+    numpy.divide(1, remaining, out=inv, where=won)
+    if weights is not None:
+        inv *= weights[:, None]
+    keys = (rows[:, lose_pos].astype(numpy.int64) * num_players
+            + rows[:, win_pos])
+    ixs = numpy.searchsorted(pair_keys, keys[valid])
+    return numpy.bincount(ixs, weights=inv[:, win_pos][valid],
+            minlength=len(pair_keys))
+
+def chain_connected(losers, winners, rates, num_players):
+    """True if every player in a comparison can reach every other through
+    the transitions with a positive rate. Otherwise the chain has absorbing
+    states, such as a player who never lost, and its stationary
+    distribution gives some players a probability of zero."""
+    import numpy
+    used = rates > 0
+    losers = losers[used]
+    winners = winners[used]
+    compared = numpy.zeros(num_players, dtype=bool)
+    compared[losers] = True
+    compared[winners] = True
+    num_compared = numpy.count_nonzero(compared)
+    if not num_compared:
+        return True
+    start = numpy.flatnonzero(compared)[0]
+    # reachable forwards and backwards from one player
+    for src, dst in ((losers, winners), (winners, losers)):
+        reached = numpy.zeros(num_players, dtype=bool)
+        reached[start] = True
+        num_reached = 1
+        while True:
+            reached[dst[reached[src]]] = True
+            _num_reached = num_reached
+            num_reached = numpy.count_nonzero(reached)
+            if num_reached == _num_reached:
+                break
+        if num_reached < num_compared:
+            return False
+    return True
+
+def stationary_distribution(losers, winners, rates, init, tolerance,
+        max_steps=100000):
+    """Stationary distribution of the continuous time chain with the given
+    transition rates, by power iteration on its lazy jump chain started
+    from init. Returns the normalized distribution and steps taken, with a
+    warning if it had not converged after max_steps."""
+    import numpy
+    num_players = len(init)
+    out_rates = numpy.bincount(losers, weights=rates, minlength=num_players)
+    probs = numpy.zeros(len(rates))
+    numpy.divide(rates, out_rates[losers], out=probs,
+            where=out_rates[losers] > 0)
+    # the jump chain visits each state in proportion to its stationary
+    # probability times its rate of leaving
+    flow = init * out_rates
+    flow /= numpy.sum(flow)
+    dist = init / numpy.sum(init)
+    for step in range(1, max_steps + 1):
+        inflow = numpy.bincount(winners, weights=flow[losers] * probs,
+                minlength=num_players)
+        flow = (flow + inflow) / 2
+        _dist = dist
+        dist = numpy.zeros(num_players)
+        numpy.divide(flow, out_rates, out=dist, where=out_rates > 0)
+        dist /= numpy.sum(dist)
+        if numpy.linalg.norm(dist - _dist) < tolerance:
+            break
     else:
-        ratings = None
-    for ranking in rankings:
-        ranks = sorted(ranking.keys(), key=lambda x: ranking[x])
-        data.append([player_ixs[player] for player in ranks])
-    ratings = ilsr_rankings(len(players), data, initial_params=ratings,
-            tol=tolerance)
-    return {players[ix]: rating for ix, rating in enumerate(ratings)}
-if HAVE_ILSR:
+        print("WARNING: Stationary distribution not converged after %d steps, L2=%.2e" % (
+            max_steps, numpy.linalg.norm(dist - _dist)))
+    return dist, step
+
+def pl_compact_ilsr(rows, num_players, tolerance, init_gammas=None,
+        chunk_size=100000, weights=None, threads=1, convergence=None):
+    """Iterative Luce spectral ranking over compact ranking rows.
+
+    From "Fast and Accurate Inference of Plackett-Luce Models" by Maystre
+    and Grossglauser. Each iteration builds the sparse Markov chain for the
+    current gammas a chunk at a time, like pl_compact, and takes its
+    stationary distribution as the next gammas. The chain's transitions are
+    found in a first pass, only their rates change between iterations.
+    Converges to the same ratings as pl_compact in far fewer iterations.
+    When the comparisons are not strongly connected, for instance a player
+    never lost, the chain has no usable stationary distribution and the
+    ratings are found with pl_compact instead. convergence decides when to
+    stop, as in pl_compact. Returns the normalized gamma array.
+    """
+    import numpy
+    chunks = [(start, min(start + chunk_size, len(rows)))
+            for start in range(0, len(rows), chunk_size)]
+    def chunk(bounds):
+        start, end = bounds
+        crows = numpy.asarray(rows[start:end])
+        cweights = None if weights is None else numpy.asarray(weights[start:end])
+        return crows, cweights
+    def chunk_keys(bounds):
+        crows, _ = chunk(bounds)
+        return pl_chunk_pair_keys(crows, num_players)
+    def chunk_rates(bounds, gammas, pair_keys):
+        crows, cweights = chunk(bounds)
+        return pl_chunk_rates(crows, gammas, pair_keys, cweights)
+    def chunk_loglik(bounds, gammas):
+        crows, cweights = chunk(bounds)
+        return pl_chunk_loglik(crows, gammas, cweights)
+
+    if convergence is None:
+        convergence = Convergence(tolerance)
+    convergence.start()
+    pool = ThreadPoolExecutor(threads) if threads > 1 else None
+    pmap = pool.map if pool else map
+    try:
+        pair_keys = numpy.unique(numpy.concatenate(
+            [numpy.zeros(0, dtype=numpy.int64)] + list(pmap(chunk_keys, chunks))))
+        losers, winners = numpy.divmod(pair_keys, num_players)
+
+        if init_gammas is not None:
+            gammas = numpy.array(init_gammas, dtype=float)
+            gammas /= numpy.sum(gammas)
+        else:
+            gammas = numpy.ones(num_players) / num_players
+        checked = False
+        while True:
+            rates = numpy.zeros(len(pair_keys))
+            for partial in pmap(chunk_rates, chunks, [gammas] * len(chunks),
+                    [pair_keys] * len(chunks)):
+                rates += partial
+            # which rates are positive does not change between iterations
+            if not checked:
+                checked = True
+                if not chain_connected(losers, winners, rates, num_players):
+                    print("Comparisons are not strongly connected, using minorization-maximization instead of iLSR.")
+                    return pl_compact(rows, num_players, tolerance,
+                            init_gammas, chunk_size, weights, threads,
+                            convergence=convergence)
+            _gammas = gammas
+            gammas, steps = stationary_distribution(losers, winners, rates,
+                    gammas, convergence.tolerance / 10)
+            loglik = None
+            if convergence.needs_loglik:
+                loglik = sum(pmap(chunk_loglik, chunks, [gammas] * len(chunks)))
+            if convergence.done(gammas, _gammas, loglik,
+                    " (%d chain steps)" % (steps,)):
+                break
+    finally:
+        if pool:
+            pool.shutdown()
+    return gammas
+
+def pl_ilsr(rankings, tolerance, init_ratings=None, convergence=None):
+    players, rows = compact_rankings(rankings)
+    init_gammas = None
+    if init_ratings:
+        init_gammas = [init_ratings.get(p, 1 / len(players)) for p in players]
+    gammas = pl_compact_ilsr(rows, len(players), tolerance, init_gammas,
+            convergence=convergence)
+    return {player: float(gamma) for player, gamma in zip(players, gammas)}
+if HAVE_NUMPY:
     plackett_luce = pl_ilsr
 
+# The bottom, always crash, bots removed by --remove-bottom
+CRASH_BOTS = 'FredericWantiez Sametine aikinogard ozadDaro cymb01 byrd106 kxmbrian sscholle patrisk jvienna ardapekis fbastos1'.split()
+
 def normalize_ratings(ratings):
     normalization_constant = sum(value for p, value in ratings)
     return [(p, v / normalization_constant) for p, v in ratings]
@@ -177,8 +700,7 @@ def check_games(games):
 
 def main(args=sys.argv[1:]):
     parser = argparse.ArgumentParser("Create Plackett-Luce ratings from game data.")
-    parser.add_argument("game_files", nargs="+",
-            help="Json files containing game data.")
+    utility.add_game_args(parser)
     parser.add_argument("-a", "--anchor-player", action="store_true",
             help="Add a player with a win and loss against every other player.")
     parser.add_argument("-r", "--remove-bottom", action="store_true",
@@ -189,12 +711,6 @@ def main(args=sys.argv[1:]):
             help="Set rating convergance tolerance.")
     parser.add_argument("-d", "--display", type=int, default=40,
             help="Limit display of rating to top N (0 for all)")
-    parser.add_argument("-n", "--num-games", type=int,
-            help="Limit the number of games used (positive for first, negative for last")
-    parser.add_argument("--remove-suspect", action="store_true",
-            help="Filter out suspect games based on workerID.")
-    parser.add_argument("--no-error", action="store_true",
-            help="Filter out games that had bot errors.")
     parser.add_argument("-o", "--out-file",
             help="If specified will write the full ratings to given filename")
     parser.add_argument("-p", "--previous-ratings",
@@ -203,21 +719,31 @@ def main(args=sys.argv[1:]):
             help="Force use of native implementation, even if numpy is available")
     parser.add_argument("--no-ilsr", action="store_true",
             help="Force use of minorization-maximization algorithm.")
+    parser.add_argument("-j", "--threads", type=int,
+            help="Use the chunked minorization-maximization algorithm with this many threads.")
+    add_convergence_args(parser)
+    utility.add_cache_args(parser)
     config = parser.parse_args(args)
+    utility.check_game_args(parser, config)
 
     global plackett_luce
-    if HAVE_ILSR and config.no_ilsr:
+    if plackett_luce == pl_ilsr and config.no_ilsr:
         plackett_luce = pl_numpy
         print("Disabled ilsr use.")
     if config.no_numpy:
         plackett_luce = pl_python
         print("Disabled numpy use.")
+    elif config.threads:
+        plackett_luce = functools.partial(pl_chunked, threads=config.threads)
     if plackett_luce == pl_python:
         print("Using plain python min-max algorithm.")
     elif plackett_luce == pl_numpy:
         print("Using numpy min-max algorithm.")
     elif plackett_luce == pl_ilsr:
         print("Using iLSR algorithm.")
+    elif isinstance(plackett_luce, functools.partial):
+        print("Using chunked min-max algorithm with %d threads." % (
+            config.threads,))
     else:
         print("Unknown implementation.")
 
@@ -235,29 +761,13 @@ def main(args=sys.argv[1:]):
         print("Excluding %s" % (excluded_players,))
     if config.remove_bottom:
         print("Removing crash bots.")
-        excluded_players += 'FredericWantiez Sametine aikinogard ozadDaro cymb01 byrd106 kxmbrian sscholle patrisk jvienna ardapekis fbastos1'.split()
-    games = utility.load_games(config.game_files)
-    if config.no_error:
-        games = utility.filter_error_games(games)
-        print("Filtered out error games, leaving %d" % (len(games),))
-    if config.remove_suspect:
-        start_num = len(games)
-        games = utility.filter_suspect_games(games)
-        print("Filtered out %d suspect games, leaving %d" % (
-            start_num - len(games), len(games)))
-
-    game_results = [{"%s (%s)" % (u['username'], u['userID']): int(u['rank'])
-        for u in g['users'] if u['username'] not in excluded_players}
-            for g in games if sum(u['username'] not in excluded_players
-                for u in g['users']) > 1]
-                    #only include games with 2 or more non-excluded competitors
-    if config.num_games:
-        if config.num_games > 0:
-            game_results = game_results[:config.num_games]
-            print("Using first %d games." % (len(game_results),))
-        else:
-            game_results = game_results[config.num_games:]
-            print("Using last %d games." % (len(game_results),))
+        excluded_players += CRASH_BOTS
+    #only include games with 2 or more non-excluded competitors
+    try:
+        game_results, game_ids = utility.load_results(config, excluded_players,
+                min_players=2)
+    except utility.ManifestError as err:
+        parser.error(str(err))
 
     winners, losers = check_games(game_results)
     if winners:
@@ -281,11 +791,31 @@ def main(args=sys.argv[1:]):
             fake_games.append({0: 2, p: 1})
         game_results += fake_games
 
-    ratings = plackett_luce(game_results, config.tolerance, init_ratings)
-
-    if config.anchor_player:
-        # remove anchor player
-        del ratings[0]
+    def rate():
+        ratings = plackett_luce(game_results, config.tolerance, init_ratings,
+                convergence=convergence)
+        if config.anchor_player:
+            # remove anchor player
+            del ratings[0]
+        return ratings
+
+    convergence = convergence_from_args(config)
+    cache = utility.open_cache(config)
+    if cache:
+        solver = getattr(plackett_luce, "func", plackett_luce).__name__
+        params = {"tolerance": config.tolerance,
+                "stop": sorted(convergence.rules),
+                "top_n": config.top_n, "stable": config.stable,
+                "max_iterations": config.max_iterations,
+                "anchor_player": config.anchor_player,
+                "init_ratings": sorted(init_ratings.items())
+                    if init_ratings else None}
+        key = cache.key(utility.results_digest(game_results, game_ids),
+                solver, params,
+                utility.filter_params(config, excluded_players, 2))
+        ratings = cache.cached(key, rate)
+    else:
+        ratings = rate()
 
     ratings = list(ratings.items())
     ratings.sort(key=lambda x: -x[1])
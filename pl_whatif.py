@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import io
+import math
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+import utility
+from pl_ranking import CRASH_BOTS, compact_rankings, pl_compact_ilsr
+
+"""
+What-if analysis of Plackett-Luce ratings with players or games removed.
+
+The games are loaded and solved once. Each scenario then masks the removed
+players out of the compact rankings, gives the removed games a weight of
+zero and re-solves starting from the full solution, which only takes a few
+iterations when the removal is small.
+"""
+
+def username(player):
+    """Username part of a "username (userID)" result name."""
+    return player.rsplit(" (", 1)[0]
+
+class PLModel:
+    """Solved Plackett-Luce ratings along with the compact rankings and
+    gameIDs they were solved from."""
+    def __init__(self, game_results, game_ids, tolerance=1e-9):
+        self.players, rows = compact_rankings(game_results)
+        self.rows = numpy.asarray(rows)
+        self.game_ids = numpy.array(game_ids, dtype=numpy.int64)
+        self.tolerance = tolerance
+        self.gammas = pl_compact_ilsr(self.rows, len(self.players), tolerance)
+
+    def player_indices(self, players):
+        """Indices of the players given by full result name or username."""
+        players = set(players)
+        return [pix for pix, name in enumerate(self.players)
+                if name in players or username(name) in players]
+
+    def ratings(self, gammas=None):
+        if gammas is None:
+            gammas = self.gammas
+        return {self.players[pix]: float(gammas[pix])
+                for pix in numpy.flatnonzero(gammas > 0)}
+
+    def without(self, players=(), game_ids=()):
+        """Ratings with the players and games removed, players left without
+        any games are dropped from the ratings."""
+        removed = self.player_indices(players)
+        rows = self.rows
+        if removed:
+            rows = numpy.where(numpy.isin(rows, removed), -1, rows)
+        weights = None
+        if game_ids:
+            weights = numpy.ones(len(rows))
+            weights[numpy.isin(self.game_ids, list(game_ids))] = 0
+        init_gammas = self.gammas.copy()
+        init_gammas[removed] = 0
+        gammas = pl_compact_ilsr(rows, len(self.players), self.tolerance,
+                init_gammas, weights=weights)
+        return self.ratings(gammas)
+
+def ranks(ratings):
+    order = sorted(ratings, key=lambda p: -ratings[p])
+    return {player: rank for rank, player in enumerate(order, start=1)}
+
+def rank_changes(before, after):
+    """(player, rank before, rank after) for the players still rated,
+    largest moves first."""
+    before = ranks(before)
+    after = ranks(after)
+    changes = [(player, before[player], rank)
+            for player, rank in after.items()]
+    changes.sort(key=lambda c: (-abs(c[1] - c[2]), c[2]))
+    return changes
+
+def run_scenarios(model, scenarios, threads=1):
+    """Ratings for each (players, game_ids) scenario. With threads > 1
+    scenarios are solved concurrently, the solvers' progress output is
+    hidden as it would be interleaved."""
+    def solve(scenario):
+        players, game_ids = scenario
+        return model.without(players, game_ids)
+    if threads > 1:
+        with contextlib.redirect_stdout(io.StringIO()):
+            with ThreadPoolExecutor(threads) as pool:
+                return list(pool.map(solve, scenarios))
+    return [solve(scenario) for scenario in scenarios]
+
+def parse_scenario(scenario):
+    """Comma separated players and game:<gameID> items."""
+    players = list()
+    game_ids = list()
+    for item in scenario.split(","):
+        item = item.strip()
+        if item.startswith("game:"):
+            game_ids.append(int(item[5:]))
+        elif item == "crash-bots":
+            players += CRASH_BOTS
+        elif item:
+            players.append(item)
+    return players, game_ids
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser("Show how Plackett-Luce ratings change with players or games removed.")
+    utility.add_game_args(parser)
+    parser.add_argument("-s", "--scenario", action="append", required=True,
+            help="Comma separated players and game:<gameID>s to remove, crash-bots for the --remove-bottom bots. May be repeated.")
+    parser.add_argument("-t", "--tolerance", type=float, default=1e-9,
+            help="Set rating convergance tolerance.")
+    parser.add_argument("-j", "--threads", type=int, default=1,
+            help="Number of scenarios to solve at once.")
+    parser.add_argument("-d", "--display", type=int, default=20,
+            help="Limit display of rank changes to the N largest (0 for all)")
+    parser.add_argument("-o", "--out-prefix",
+            help="If specified will write each scenario's ratings to <prefix>-<N>.csv")
+    config = parser.parse_args(args)
+    utility.check_game_args(parser, config)
+
+    try:
+        game_results, game_ids = utility.load_results(config, min_players=2)
+    except utility.ManifestError as err:
+        parser.error(str(err))
+    print("Solving full ratings for %d games." % (len(game_results),))
+    model = PLModel(game_results, game_ids, config.tolerance)
+    base = model.ratings()
+
+    scenarios = [parse_scenario(s) for s in config.scenario]
+    results = run_scenarios(model, scenarios, config.threads)
+
+    for snum, (desc, ratings) in enumerate(zip(config.scenario, results),
+            start=1):
+        changes = rank_changes(base, ratings)
+        moved = sum(1 for c in changes if c[1] != c[2])
+        print("Scenario %d (%s): %d players removed, %d players changed rank" % (
+            snum, desc, len(base) - len(ratings), moved))
+
+        if config.out_prefix:
+            out_file = "%s-%d.csv" % (config.out_prefix, snum)
+            total = sum(ratings.values())
+            with open(out_file, 'w') as out:
+                for player, before, rank in sorted(changes, key=lambda c: c[2]):
+                    out.write('%d,%s,%r\n' % (rank, player,
+                        ratings[player] / total))
+
+        if config.display > 0:
+            changes = changes[:config.display]
+        changes = [c for c in changes if c[1] != c[2]]
+        if not changes:
+            continue
+        rwidth = math.floor(math.log10(len(base))) + 1
+        pwidth = max(len(c[0]) for c in changes)
+        for player, before, after in changes:
+            print("  %*s %*d -> %*d (%+d)" % (pwidth, player, rwidth, before,
+                rwidth, after, before - after))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import argparse
+import math
+import sys
+
+import trueskill
+
+import utility
+from rating_stats import order_terms, rmse_terms, ts_order, ts_winp, wl_winp
+from ts_ranking import TSRater
+from wl_ranking import WLBTRater, WLPLRater
+
+"""
+Prequential (predict then update) evaluation of the online rating systems.
+Each game's pairwise results are predicted from the ratings before the game
+is used to update them, so the games only need to be read and rated once.
+"""
+
+class PrequentialStats:
+    """Running totals of the rating_stats metrics."""
+    def __init__(self):
+        self.games = 0
+        self.sum_errors = 0.
+        self.num_wrong = 0
+        self.num_predictions = 0
+
+    def add(self, sum_errors, num_wrong, num_predictions):
+        self.games += 1
+        self.sum_errors += sum_errors
+        self.num_wrong += num_wrong
+        self.num_predictions += num_predictions
+
+    def rmse(self):
+        return math.sqrt(self.sum_errors / self.num_predictions)
+
+    def order_error(self):
+        return self.num_wrong / self.num_predictions
+
+def prequential_stats(game_results, rater, winp, rank_order, window=10000,
+        subjects=None):
+    """Rate the games in a single pass, predicting each one before it is used.
+
+    Yields the window and cumulative PrequentialStats after every window
+    games and once more for any final partial window.
+    """
+    total = PrequentialStats()
+    current = PrequentialStats()
+    for game in game_results:
+        ratings = {player: rater.rating(player) for player in game}
+        sum_errors, num_predictions, _ = rmse_terms([game], ratings, winp,
+                subjects)
+        num_wrong, _, _ = order_terms([game], ratings, rank_order, subjects)
+        total.add(sum_errors, num_wrong, num_predictions)
+        current.add(sum_errors, num_wrong, num_predictions)
+        rater.update(game)
+        if current.games == window:
+            yield current, total
+            current = PrequentialStats()
+    if current.games:
+        yield current, total
+
+def make_system(system, tau=None):
+    """Get a new rater along with its win probability and order functions."""
+    if system == "ts":
+        env = trueskill.TrueSkill()
+        if tau is not None:
+            env.tau = tau
+        eval_env = trueskill.TrueSkill(draw_probability=0.)
+        winp = lambda a, b: ts_winp(a, b, eval_env)
+        return TSRater(env), winp, ts_order
+    if system == "wl-bt":
+        return WLBTRater(), wl_winp, ts_order
+    if system == "wl-pl":
+        return WLPLRater(), wl_winp, ts_order
+    raise ValueError("Unknown rating system %s" % (system,))
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser("Evaluate an online rating system in a single predict then update pass.")
+    utility.add_game_args(parser)
+    parser.add_argument("-s", "--system", choices=["ts", "wl-bt", "wl-pl"],
+            default="ts",
+            help="Rating system to evaluate. (Default ts)")
+    parser.add_argument("-t", "--tau", type=float,
+            help="Set trueskill tau.")
+    parser.add_argument("-w", "--window", type=int, default=10000,
+            help="Number of games in each reported window.")
+    config = parser.parse_args(args)
+    utility.check_game_args(parser, config)
+
+    try:
+        game_results, _ = utility.load_results(config)
+    except utility.ManifestError as err:
+        parser.error(str(err))
+
+    rater, winp, rank_order = make_system(config.system, config.tau)
+    for window, total in prequential_stats(game_results, rater, winp,
+            rank_order, config.window):
+        print("%d games: window RMSE %f, %.2f%% misordered;"
+                " cumulative RMSE %f, %.2f%% misordered" % (
+                    total.games, window.rmse(), window.order_error() * 100,
+                    total.rmse(), total.order_error() * 100))
+
+if __name__ == "__main__":
+    main()
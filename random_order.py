@@ -1,44 +1,39 @@
 #!/usr/bin/env python3
 
 import argparse
-import json
 import random
 import statistics
 import sys
 
 import utility
-import trueskill
-from ts_ranking import ts_ratings
-from rating_stats import ratings_order_error, ts_order
-from wl_ranking import wl_bt_ratings, wl_pl_ratings
 
 def main(args=sys.argv[1:]):
     parser = argparse.ArgumentParser("Test ratings from randomly ordered game data.")
-    parser.add_argument("game_files", nargs="+",
-            help="Json files containing game data.")
+    utility.add_game_args(parser)
     parser.add_argument("-t", "--test-games", action="append",
-            help="Json files containing game data to test ratings against.")
-    parser.add_argument("-n", "--num-trials", type=int, default=100,
+            help="Json files containing game data to test ratings against, filtered like the game files.")
+    parser.add_argument("--num-trials", type=int, default=100,
             help="Number of trials to run.")
     config = parser.parse_args(args)
+    utility.check_game_args(parser, config)
 
-    games = utility.load_games(config.game_files)
-    game_results = [{"%s (%s)" % (u['username'], u['userID']): int(u['rank'])
-        for u in g['users']}
-            for g in games]
+    from rating_stats import ratings_order_error, ts_order
+    from wl_ranking import wl_pl_ratings
 
-    if len(config.test_games) > 0:
-        test_games = utility.load_games(config.test_games)
-        test_results = [{"%s (%s)" % (u['username'], u['userID']): int(u['rank'])
-            for u in g['users']}
-                for g in test_games]
-    else:
-        test_games = list(games)
+    try:
+        game_results, _ = utility.load_results(config)
+        if config.test_games:
+            test_config = argparse.Namespace(**vars(config))
+            test_config.game_files = config.test_games
+            test_results, _ = utility.load_results(test_config)
+        else:
+            test_results = list(game_results)
+    except utility.ManifestError as err:
+        parser.error(str(err))
 
     rating_errors = list()
     for i in range(config.num_trials):
         random.shuffle(game_results)
-        #ratings = ts_ratings(game_results)
         ratings = wl_pl_ratings(game_results)
 
         ordering_ratio = ratings_order_error(test_results, ratings, ts_order)
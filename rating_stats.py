@@ -1,15 +1,16 @@
 #!/usr/bin/env python3
 
 import argparse
+import importlib.util
 import json
 import math
 import sys
 from collections import defaultdict
 
-import trueskill
-import matplotlib.pyplot as plot
 import utility
 
+HAVE_SCIPY = importlib.util.find_spec("scipy") is not None
+
 def phi(x):
     """Cumulative distribution function for the standard normal distribution
     Taken from python math module documentation"""
@@ -18,6 +19,7 @@ def phi(x):
 def ts_winp(a, b, env=None):
     """Win probability of player a over b given their trueskill ratings.
     Formula found at https://github.com/sublee/trueskill/issues/1#issuecomment-244699989"""
+    import trueskill
     if not env:
         env = trueskill.global_env()
     epsilon = trueskill.calc_draw_margin(env.draw_probability, 2)
@@ -32,7 +34,50 @@ def pl_winp(a, b):
     """Win probability of player a over b given their PL ratings."""
     return a / (a + b)
 
-def ratings_rmse(game_results, ratings, winp_func, subjects=None):
+def erf_array(x):
+    """Elementwise erf of an array, from scipy when available otherwise by
+    Abramowitz and Stegun formula 7.1.26, within 1.5e-7 of math.erf."""
+    import numpy
+    if HAVE_SCIPY:
+        from scipy.special import erf
+        return erf(x)
+    x = numpy.asarray(x, dtype=float)
+    t = 1 / (1 + 0.3275911 * numpy.abs(x))
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741
+        + t * (-1.453152027 + t * 1.061405429))))
+    return numpy.sign(x) * (1 - poly * numpy.exp(-x * x))
+
+def ts_winp_matrix(mu, sigma, env=None):
+    """Matrix of ts_winp for every pair, entry [i, j] is the probability
+    player i beats player j."""
+    import numpy
+    import trueskill
+    if not env:
+        env = trueskill.global_env()
+    mu = numpy.asarray(mu, dtype=float)
+    var = numpy.asarray(sigma, dtype=float) ** 2
+    epsilon = trueskill.calc_draw_margin(env.draw_probability, 2)
+    denom = numpy.sqrt(var[:, None] + var[None, :] + (2 * env.beta**2))
+    x = (mu[:, None] - mu[None, :] - epsilon) / denom
+    return (1.0 + erf_array(x / math.sqrt(2.0))) / 2.0
+
+def wl_winp_matrix(mu, sigma):
+    """Matrix of wl_winp for every pair."""
+    import numpy
+    mu = numpy.asarray(mu, dtype=float)
+    var = numpy.asarray(sigma, dtype=float) ** 2
+    ciq = numpy.sqrt(var[:, None] + var[None, :] + (2 * (25/6)**2))
+    return 1 / (1 + numpy.exp((mu[None, :] - mu[:, None]) / ciq))
+
+def pl_winp_matrix(gammas):
+    """Matrix of pl_winp for every pair."""
+    import numpy
+    gammas = numpy.asarray(gammas, dtype=float)
+    return gammas[:, None] / (gammas[:, None] + gammas[None, :])
+
+def rmse_terms(game_results, ratings, winp_func, subjects=None):
+    """Sum of squared errors, number of predictions and number of missed
+    predictions for the pairwise results of the given games."""
     sum_errors = 0
     num_missed = 0
     num_predictions = 0
@@ -49,6 +94,11 @@ def ratings_rmse(game_results, ratings, winp_func, subjects=None):
                 winr = 1 if prank < orank else 0
                 sum_errors += (winp - winr)**2
                 num_predictions += 1
+    return sum_errors, num_predictions, num_missed
+
+def ratings_rmse(game_results, ratings, winp_func, subjects=None):
+    sum_errors, num_predictions, num_missed = rmse_terms(game_results,
+            ratings, winp_func, subjects)
     if num_missed:
         print("Could not make a prediction for %d pairs." % (
             num_missed,))
@@ -61,7 +111,9 @@ def ts_order(a, b):
 def pl_order(a, b):
     return a > b
 
-def ratings_order_error(game_results, ratings, rank_order, subjects=None):
+def order_terms(game_results, ratings, rank_order, subjects=None):
+    """Number of wrong predictions, number of predictions and number of
+    missed predictions for the pairwise results of the given games."""
     num_wrong = 0
     num_missed = 0
     num_predictions = 0
@@ -81,6 +133,11 @@ def ratings_order_error(game_results, ratings, rank_order, subjects=None):
                 if (better == worse) or (better != (prank < orank)):
                     num_wrong += 1
                 num_predictions += 1
+    return num_wrong, num_predictions, num_missed
+
+def ratings_order_error(game_results, ratings, rank_order, subjects=None):
+    num_wrong, num_predictions, num_missed = order_terms(game_results,
+            ratings, rank_order, subjects)
     if num_missed:
         print("Could not make a prediction for %d pairs." % (
             num_missed,))
@@ -114,6 +171,7 @@ def best_scores(game_results):
     print("True probability incorrectly ordered %f%% results" % (order_ratio * 100,))
 
 def load_ts_ratings(filename):
+    import trueskill
     ratings = dict()
     with open(filename) as rfile:
         for line in rfile:
@@ -130,27 +188,51 @@ def load_pl_ratings(filename):
             ratings[player.strip()] = float(rating)
     return ratings
 
+def player_history(store, name, ratings, winp_func):
+    """Print a player's games with their expected and actual pairwise wins."""
+    players = [p for p in store.names if p == name
+            or p.rsplit(" (", 1)[0] == name]
+    if not players:
+        print("No games found for %s" % (name,))
+        return
+    player = players[0]
+    print("Games of %s:" % (player,))
+    total_expected = 0
+    total_wins = 0
+    for gix in store.games_of(player):
+        game = store.result(gix)
+        prank = game[player]
+        expected = 0
+        wins = 0
+        for opp, orank in game.items():
+            if opp == player:
+                continue
+            if player in ratings and opp in ratings:
+                expected += winp_func(ratings[player], ratings[opp])
+            wins += prank < orank
+        total_expected += expected
+        total_wins += wins
+        print("%d: %d of %d, %.2f expected wins, %d won" % (
+            store.game_ids[gix], prank, len(game), expected, wins))
+    print("Total %.2f expected wins, %d won" % (total_expected, total_wins))
+
 def main(args=sys.argv[1:]):
     parser = argparse.ArgumentParser("Gather various performance statistics from ratings.")
-    parser.add_argument("game_files", nargs="+",
-            help="Json files containing game data.")
-    parser.add_argument("-n", "--num-games", type=int,
-            help="Limit the number of games used (positive for first, negative for last")
-    parser.add_argument("--remove-suspect", action="store_true",
-            help="Filter out suspect games based on workerID.")
-    parser.add_argument("--no-error", action="store_true",
-            help="Filter out games that had bot errors.")
+    utility.add_game_args(parser)
     parser.add_argument("-r", "--ratings", required=True,
             help="File with ratings of players.")
     parser.add_argument("--subjects",
             help="File with players to include.")
     parser.add_argument("--subjects-num", type=int,
             help="Only use first n subjects.")
+    parser.add_argument("--history",
+            help="Show the expected and actual pairwise wins in each game of a player.")
     parser.add_argument("--calc-best", action="store_true",
             help="Calculate best possible rates using true win percentages.")
     parser.add_argument("--type", choices=["ts", "wl"],
             help="Type of ratings, ts=trueskill or wl=Weng-Lin.")
     config = parser.parse_args(args)
+    utility.check_game_args(parser, config)
 
     with open(config.ratings) as rfile:
         line = rfile.readline()
@@ -192,34 +274,31 @@ def main(args=sys.argv[1:]):
     else:
         subjects = None
 
-    games = utility.load_games(config.game_files)
-    if config.no_error:
-        games = utility.filter_error_games(games)
-        print("Filtered out error games, leaving %d" % (len(games),))
-    if config.remove_suspect:
-        start_num = len(games)
-        games = utility.filter_suspect_games(games)
-        print("Filtered out %d suspect games, leaving %d" % (
-            start_num - len(games), len(games)))
-
-    game_results = [{"%s (%s)" % (u['username'], u['userID']): int(u['rank'])
-        for u in g['users']}
-            for g in games]
-    if config.num_games:
-        if config.num_games > 0:
-            game_results = game_results[:config.num_games]
-            print("Using first %d games." % (len(game_results),))
-        else:
-            game_results = game_results[config.num_games:]
-            print("Using last %d games." % (len(game_results),))
-
-    trueskill.setup(draw_probability = 0.)
+    # the store is loaded once for both the results and the history
+    store = None
+    if config.history:
+        store = utility.load_store(config.game_files, config.load_jobs,
+                config.store)
+    # with subjects only the games they played are loaded, found with the
+    # player index, unless the best rates need every game
+    try:
+        game_results, _ = utility.load_results(config,
+                players=None if config.calc_best else subjects, store=store)
+    except utility.ManifestError as err:
+        parser.error(str(err))
+
+    if load_ratings == load_ts_ratings:
+        import trueskill
+        trueskill.setup(draw_probability = 0.)
     rmse = ratings_rmse(game_results, ratings, winp, subjects)
     print("Given ratings RMSE %f" % (rmse,))
     ordering_ratio = ratings_order_error(game_results, ratings, rank_order, subjects)
     print("Given ratings incorrectly ordered %.2f%% results" % (
         ordering_ratio * 100,))
 
+    if config.history:
+        player_history(store, config.history, ratings, winp)
+
     if config.calc_best:
         best_scores(game_results)
 
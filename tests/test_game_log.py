@@ -0,0 +1,30 @@
+import json
+import os
+
+import pytest
+
+import utility
+from game_log import GameLog
+
+GAMES = [{"gameID": str(gid), "workerID": "7", "users": [
+            {"username": "a", "userID": "1", "rank": "1", "errorLogName": None},
+            {"username": "b", "userID": "2", "rank": "2", "errorLogName": "b.log"},
+            ]} for gid in (3, 1, 2)]
+
+def test_reader_does_not_create_log(tmp_path):
+    missing = tmp_path / "missing"
+    with pytest.raises(ValueError):
+        GameLog(str(missing))
+    assert not missing.exists()
+
+def test_iter_games_reads_logs(tmp_path):
+    log = GameLog(str(tmp_path / "log"), create=True)
+    assert log.ingest(GAMES) == (3, 0)
+    assert log.ingest(GAMES[:1]) == (0, 1)
+    game_file = tmp_path / "games.json"
+    game_file.write_text(json.dumps(GAMES))
+    from_log = list(utility.iter_games([str(tmp_path / "log")]))
+    assert [g['gameID'] for g in from_log] == ["1", "2", "3"]
+    from_json = sorted(utility.iter_games([str(game_file)]),
+            key=lambda g: int(g['gameID']))
+    assert from_log == from_json
@@ -0,0 +1,34 @@
+import random
+
+import numpy
+
+from pl_decay import DecayedPL
+from pl_ranking import pl_chunk_wins
+
+def random_games(count, players, seed):
+    rng = random.Random(seed)
+    games = list()
+    for _ in range(count):
+        seats = rng.sample(players, rng.randint(2, 4))
+        games.append({p: rank + 1 for rank, p in enumerate(seats)})
+    return games
+
+def test_incremental_counts_match_recount(tmp_path):
+    # the early players stop playing and are pruned with their games
+    games = (random_games(150, list("abcdef"), 1)
+            + random_games(250, list("defghi"), 2))
+    model = DecayedPL(half_life=20, prune=1e-3)
+    for start in range(0, len(games), 30):
+        batch = games[start:start + 30]
+        model.add_games(batch, list(range(start, start + len(batch))))
+        model.save(str(tmp_path))
+        model = DecayedPL.load(str(tmp_path))
+    assert set(model.players) == set("defghi")
+    num_players = len(model.players)
+    numpy.testing.assert_allclose(model.wins,
+            pl_chunk_wins(model.rows, num_players, model.weights),
+            rtol=1e-12, atol=1e-15)
+    numpy.testing.assert_array_equal(model.won,
+            pl_chunk_wins(model.rows, num_players))
+    numpy.testing.assert_array_equal(model.played, numpy.bincount(
+        model.rows[model.rows >= 0], minlength=num_players))
@@ -0,0 +1,65 @@
+import numpy
+
+from pl_ranking import (chain_connected, compact_rankings, pl_compact,
+        pl_compact_ilsr, stationary_distribution)
+
+CONNECTED = [
+        {"a": 1, "b": 2, "c": 3},
+        {"b": 1, "a": 2},
+        {"c": 1, "a": 2, "b": 3},
+        {"a": 1, "c": 2},
+        {"b": 1, "c": 2},
+        ]
+
+UNDEFEATED = [
+        {"a": 1, "b": 2},
+        {"a": 1, "c": 2},
+        {"b": 1, "c": 2},
+        {"c": 1, "b": 2},
+        {"a": 1, "b": 2, "c": 3},
+        ]
+
+def solve(games, solver, tolerance=1e-12):
+    players, rows = compact_rankings(games)
+    gammas = solver(numpy.asarray(rows), len(players), tolerance)
+    return dict(zip(players, gammas))
+
+def test_ilsr_matches_mm():
+    ilsr = solve(CONNECTED, pl_compact_ilsr)
+    mm = solve(CONNECTED, pl_compact)
+    for player in mm:
+        assert abs(ilsr[player] - mm[player]) < 1e-9
+
+def test_ilsr_undefeated_player_matches_mm(capsys):
+    ilsr = solve(UNDEFEATED, pl_compact_ilsr, 1e-9)
+    mm = solve(UNDEFEATED, pl_compact, 1e-9)
+    assert "not strongly connected" in capsys.readouterr().out
+    assert max(ilsr, key=ilsr.get) == "a"
+    for player in mm:
+        assert abs(ilsr[player] - mm[player]) < 1e-12
+
+def test_chain_connected():
+    losers = numpy.array([1, 2, 2])
+    winners = numpy.array([0, 0, 1])
+    rates = numpy.ones(3)
+    # 0 never loses
+    assert not chain_connected(losers, winners, rates, 3)
+    losers = numpy.append(losers, 0)
+    winners = numpy.append(winners, 2)
+    assert chain_connected(losers, winners, numpy.ones(4), 3)
+    # a zero rate, from a zero weighted game, is not a transition
+    assert not chain_connected(losers, winners,
+            numpy.array([1., 1., 1., 0.]), 3)
+
+def test_stationary_distribution_warns_when_not_converged(capsys):
+    losers = numpy.array([0, 1, 2])
+    winners = numpy.array([1, 2, 0])
+    rates = numpy.array([1., 2., 3.])
+    init = numpy.array([0.8, 0.1, 0.1])
+    dist, steps = stationary_distribution(losers, winners, rates, init,
+            1e-15, max_steps=3)
+    assert steps == 3
+    assert "not converged" in capsys.readouterr().out
+    dist, steps = stationary_distribution(losers, winners, rates, init,
+            1e-12)
+    numpy.testing.assert_allclose(dist, numpy.array([6, 3, 2]) / 11)
@@ -0,0 +1,31 @@
+from pl_whatif import PLModel, rank_changes
+
+# x is the only player who ever beat a
+GAMES = [
+        {"x": 1, "a": 2},
+        {"x": 1, "a": 2},
+        {"x": 1, "a": 2, "b": 3},
+        {"a": 1, "b": 2},
+        {"a": 1, "c": 2},
+        {"b": 1, "c": 2},
+        {"c": 1, "b": 2},
+        {"b": 1, "x": 2},
+        {"c": 1, "x": 2},
+        ]
+
+def model():
+    return PLModel(GAMES, list(range(1, len(GAMES) + 1)), 1e-6)
+
+def test_removal_leaving_player_undefeated():
+    whatif = model()
+    before = whatif.ratings()
+    assert max(before, key=before.get) == "x"
+    after = whatif.without(["x"])
+    assert set(after) == {"a", "b", "c"}
+    changes = {player: (old, new)
+            for player, old, new in rank_changes(before, after)}
+    assert changes["a"] == (2, 1)
+
+def test_removed_games_keep_players():
+    after = model().without(game_ids=[1, 2])
+    assert set(after) == {"a", "b", "c", "x"}
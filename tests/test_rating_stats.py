@@ -0,0 +1,46 @@
+import numpy
+import pytest
+import trueskill
+
+import rating_stats
+from rating_stats import (pl_winp, pl_winp_matrix, ts_winp, ts_winp_matrix,
+        wl_winp, wl_winp_matrix)
+
+# Largest difference allowed between matrix entries and the scalar win
+# probabilities, the erf approximation used without scipy is within 1.5e-7
+# of math.erf
+WINP_TOLERANCE = 1e-6
+
+def ratings(num_players=30, seed=1):
+    rng = numpy.random.default_rng(seed)
+    return rng.normal(25, 5, num_players), rng.uniform(0.5, 8, num_players)
+
+@pytest.mark.parametrize("have_scipy", [True, False])
+def test_ts_winp_matrix(monkeypatch, have_scipy):
+    if have_scipy and not rating_stats.HAVE_SCIPY:
+        pytest.skip("scipy not installed")
+    monkeypatch.setattr(rating_stats, "HAVE_SCIPY", have_scipy)
+    env = trueskill.TrueSkill(draw_probability=0.)
+    mu, sigma = ratings()
+    matrix = ts_winp_matrix(mu, sigma, env)
+    for i in range(len(mu)):
+        for j in range(len(mu)):
+            expected = ts_winp(trueskill.Rating(mu[i], sigma[i]),
+                    trueskill.Rating(mu[j], sigma[j]), env)
+            assert abs(matrix[i, j] - expected) < WINP_TOLERANCE
+
+def test_wl_winp_matrix():
+    mu, sigma = ratings()
+    matrix = wl_winp_matrix(mu, sigma)
+    for i in range(len(mu)):
+        for j in range(len(mu)):
+            expected = wl_winp(trueskill.Rating(mu[i], sigma[i]),
+                    trueskill.Rating(mu[j], sigma[j]))
+            assert abs(matrix[i, j] - expected) < WINP_TOLERANCE
+
+def test_pl_winp_matrix():
+    gammas = numpy.random.default_rng(2).uniform(0.01, 1, 30)
+    matrix = pl_winp_matrix(gammas)
+    for i in range(len(gammas)):
+        for j in range(len(gammas)):
+            assert abs(matrix[i, j] - pl_winp(gammas[i], gammas[j])) < WINP_TOLERANCE
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import io
+import math
+import sys
+import time
+
+import numpy
+
+from multi_ranking import ONLINE_SYSTEMS
+from pl_ranking import pl_compact_ilsr
+
+"""
+Simulated tournaments between players with known skills, to measure how
+quickly each rating system recovers the true ordering.
+
+Games are generated a batch at a time with vectorized sampling. With finals
+seeding each game is built around a random seed player with opponents from
+near it on the current leaderboard, and at the cut points the bottom of the
+leaderboard stops being seeded into games, as in the Halite finals. The
+seeding leaderboard ranks players by their average finishing percentile,
+a cheap stand in for the TrueSkill leaderboard used in the finals.
+"""
+
+# (fraction of games played, fraction of players kept) for the finals cuts
+FINALS_CUTS = [(0.3, 0.6), (0.5, 0.4), (0.7, 0.25)]
+
+class TournamentSim:
+    """Generates games as compact ranking rows, player indices in finishing
+    order padded with -1."""
+    def __init__(self, num_players, skill_sd=1., model="pl", beta=1.,
+            seeding="finals", window=10, max_players=6, seed=None):
+        self.rng = numpy.random.default_rng(seed)
+        self.num_players = num_players
+        # log gammas for pl, performance means for gaussian
+        self.skills = self.rng.normal(0, skill_sd, num_players)
+        self.model = model
+        self.beta = beta
+        self.seeding = seeding
+        self.window = window
+        self.max_players = max_players
+        self.active = numpy.arange(num_players)
+        self.percentile_sums = numpy.zeros(num_players)
+        self.games_played = numpy.zeros(num_players)
+
+    def leaderboard(self):
+        """Active players ordered best first by smoothed average finishing
+        percentile."""
+        score = ((self.percentile_sums[self.active] + 1)
+                / (self.games_played[self.active] + 2))
+        return self.active[numpy.argsort(-score, kind="stable")]
+
+    def cut(self, keep):
+        """Stop seeding all but the top keep fraction of all players."""
+        num_keep = max(self.max_players, int(self.num_players * keep))
+        self.active = numpy.sort(self.leaderboard()[:num_keep])
+
+    def players(self, batch):
+        """Players for a batch of games, -1 padded to max_players."""
+        rng = self.rng
+        num_active = len(self.active)
+        max_players = min(self.max_players, num_active)
+        sizes = rng.integers(2, max_players + 1, batch)
+        if self.seeding == "random":
+            board = self.active
+            width = num_active
+            starts = numpy.zeros(batch, dtype=int)
+            keys = rng.random((batch, width))
+        else:
+            board = self.leaderboard()
+            width = min(2 * self.window + 1, num_active)
+            seeds = rng.integers(0, num_active, batch)
+            starts = numpy.clip(seeds - self.window, 0, num_active - width)
+            keys = rng.random((batch, width))
+            # the seed player is always picked
+            keys[numpy.arange(batch), seeds - starts] = -1
+        slots = numpy.argsort(keys, axis=1)[:, :max_players]
+        players = board[starts[:, None] + slots]
+        players[numpy.arange(max_players)[None, :] >= sizes[:, None]] = -1
+        if max_players < self.max_players:
+            pad = numpy.full((batch, self.max_players - max_players), -1)
+            players = numpy.hstack([players, pad])
+        return players
+
+    def play(self, players):
+        """Finishing orders for the games, in the same row format."""
+        active = players >= 0
+        skills = self.skills[numpy.maximum(players, 0)]
+        if self.model == "pl":
+            noise = self.rng.gumbel(size=players.shape)
+        else:
+            noise = self.rng.normal(0, self.beta, players.shape)
+        perf = numpy.where(active, skills + noise, -numpy.inf)
+        order = numpy.argsort(-perf, axis=1)
+        rows = numpy.take_along_axis(players, order, axis=1)
+
+        sizes = numpy.sum(active, axis=1)
+        places = numpy.arange(rows.shape[1])[None, :]
+        percentiles = (sizes[:, None] - 1 - places) / (sizes[:, None] - 1)
+        finished = rows >= 0
+        self.percentile_sums += numpy.bincount(rows[finished],
+                weights=percentiles[finished], minlength=self.num_players)
+        self.games_played += numpy.bincount(rows[finished],
+                minlength=self.num_players)
+        return rows
+
+    def games(self, num_games, batch_size=10000, cuts=()):
+        """Yield batches of game rows, making the cuts as the given fractions
+        of num_games are reached."""
+        cuts = sorted(cuts)
+        played = 0
+        while played < num_games:
+            while cuts and played >= cuts[0][0] * num_games:
+                self.cut(cuts.pop(0)[1])
+            # batches end on multiples of batch_size and at the cuts
+            batch = batch_size - played % batch_size
+            if cuts:
+                batch = min(batch, math.ceil(cuts[0][0] * num_games) - played)
+            batch = min(batch, num_games - played)
+            yield self.play(self.players(batch))
+            played += batch
+
+def spearman(scores, skills):
+    """Spearman rank correlation of two score arrays."""
+    if len(scores) < 2:
+        return float("nan")
+    ra = numpy.argsort(numpy.argsort(scores)).astype(float)
+    rb = numpy.argsort(numpy.argsort(skills)).astype(float)
+    return float(numpy.corrcoef(ra, rb)[0, 1])
+
+def parse_cut(cut):
+    at, keep = cut.split(":")
+    return float(at), float(keep)
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser("Measure how quickly rating systems recover known skills in simulated tournaments.")
+    parser.add_argument("-p", "--players", type=int, default=1600,
+            help="Number of players.")
+    parser.add_argument("-g", "--games", type=int, default=100000,
+            help="Number of games to play.")
+    parser.add_argument("-s", "--system", action="append",
+            choices=sorted(ONLINE_SYSTEMS) + ["pl", "none"],
+            help="Rating system to evaluate, may be repeated, none only generates games. (Default all)")
+    parser.add_argument("--seeding", choices=["finals", "random"],
+            default="finals",
+            help="Pick opponents near a seed player on the leaderboard or at random.")
+    parser.add_argument("-w", "--window", type=int, default=10,
+            help="Leaderboard positions either side of the seed player opponents come from.")
+    parser.add_argument("--cut", action="append", type=parse_cut,
+            help="GAMES:KEEP, after fraction GAMES of the games only seed the top fraction KEEP of players. (Default finals like cuts)")
+    parser.add_argument("--no-cuts", action="store_true",
+            help="Keep seeding every player.")
+    parser.add_argument("--model", choices=["pl", "gaussian"], default="pl",
+            help="Plackett-Luce (Gumbel) or Gaussian performance noise.")
+    parser.add_argument("--skill-sd", type=float, default=1.,
+            help="Standard deviation of the latent skills.")
+    parser.add_argument("-b", "--batch-size", type=int, default=10000,
+            help="Number of games generated at a time.")
+    parser.add_argument("-r", "--report-every", type=int, default=10000,
+            help="Report rank correlations every N games.")
+    parser.add_argument("--seed", type=int,
+            help="Random seed.")
+    config = parser.parse_args(args)
+
+    systems = config.system or sorted(ONLINE_SYSTEMS) + ["pl"]
+    systems = [s for s in systems if s != "none"]
+    cuts = [] if config.no_cuts else (config.cut or FINALS_CUTS)
+    batch_size = math.gcd(config.batch_size, config.report_every)
+
+    sim = TournamentSim(config.players, config.skill_sd, config.model,
+            seeding=config.seeding, window=config.window, seed=config.seed)
+    names = ["p%d" % (pix,) for pix in range(config.players)]
+    raters = {s: ONLINE_SYSTEMS[s]() for s in systems if s in ONLINE_SYSTEMS}
+    pl_rows = list()
+    pl_gammas = None
+
+    print("games  active  " + "  ".join("%8s" % (s,) for s in systems))
+    played = 0
+    next_report = config.report_every
+    gen_time = 0.
+    start = time.perf_counter()
+    games = sim.games(config.games, batch_size, cuts)
+    while True:
+        gen_start = time.perf_counter()
+        rows = next(games, None)
+        gen_time += time.perf_counter() - gen_start
+        if rows is None:
+            break
+        if raters:
+            for row in rows.tolist():
+                game = {names[pix]: place for place, pix in
+                        enumerate(row, start=1) if pix >= 0}
+                for rater in raters.values():
+                    rater.update(game)
+        if "pl" in systems:
+            pl_rows.append(rows.astype(numpy.int32))
+        played += len(rows)
+        if played < next_report and played < config.games:
+            continue
+        next_report += config.report_every
+
+        seen = numpy.flatnonzero(sim.games_played > 0)
+        correlations = list()
+        for system in systems:
+            if system == "pl":
+                all_rows = numpy.vstack(pl_rows)
+                pl_rows = [all_rows]
+                init = None
+                if pl_gammas is not None:
+                    init = numpy.where(pl_gammas > 0, pl_gammas,
+                            1 / config.players)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    pl_gammas = pl_compact_ilsr(all_rows, config.players,
+                            1e-8, init)
+                scores = pl_gammas[seen]
+            else:
+                rater = raters[system]
+                scores = numpy.array([rater.mu[rater.index[names[pix]]]
+                    - 3 * rater.sigma[rater.index[names[pix]]]
+                    for pix in seen])
+            correlations.append(spearman(scores, sim.skills[seen]))
+        print("%6d  %6d  " % (played, len(sim.active)) + "  ".join(
+            "%8.4f" % (c,) for c in correlations))
+    total = time.perf_counter() - start
+    print("Generated %d games in %.2f seconds (%.0f games per second), %.2f seconds total" % (
+        played, gen_time, played / max(gen_time, 1e-9), total))
+
+if __name__ == "__main__":
+    main()
@@ -8,64 +8,74 @@ import sys
 import trueskill
 import utility
 
-def ts_ratings(game_results):
-    players = {p: trueskill.Rating() for p in
-            set(p for game in game_results for p in game)}
-    for gnum, game in enumerate(game_results, start=1):
+class TSRater(utility.OnlineRater):
+    """TrueSkill ratings updated one game at a time."""
+    system = "ts"
+
+    def __init__(self, env=None):
+        super().__init__()
+        if env is None:
+            env = trueskill.global_env()
+        self.env = env
+
+    def params(self):
+        env = self.env
+        return {"mu": env.mu, "sigma": env.sigma, "beta": env.beta,
+                "tau": env.tau, "draw_probability": env.draw_probability}
+
+    def initial_rating(self, player):
+        return self.env.mu, self.env.sigma
+
+    def rating(self, player):
+        pix = self.index.get(player)
+        if pix is None:
+            return self.env.create_rating()
+        return self.env.create_rating(self.mu[pix], self.sigma[pix])
+
+    def update(self, game):
         game = list(game.items())
-        ratings = [{p[0]: players[p[0]]} for p in game]
-        ranks = [(p[1],) for p in game]
-        ratings = trueskill.rate(ratings, ranks)
-        for group in ratings:
-            for name, rating in group.items():
-                players[name] = rating
-        if gnum % 10000 == 0:
-            print("\rRated %d games" % (gnum,), end="")
-    if gnum >= 10000:
-        print("\r", end="")
-    print("Rated %d games" % (gnum,))
-    return players
+        pixs = [self.player_index(p[0]) for p in game]
+        ratings = [(self.env.create_rating(self.mu[pix], self.sigma[pix]),)
+                for pix in pixs]
+        ranks = [p[1] for p in game]
+        ratings = self.env.rate(ratings, ranks)
+        for pix, (rating,) in zip(pixs, ratings):
+            self.mu[pix] = rating.mu
+            self.sigma[pix] = rating.sigma
+        self.games_rated += 1
+
+    def ratings(self):
+        return {name: self.env.create_rating(mu, sigma)
+                for name, mu, sigma in zip(self.names, self.mu, self.sigma)}
+
+def ts_ratings(game_results):
+    return utility.rate_games(TSRater(), game_results)
 
 def main(args=sys.argv[1:]):
     parser = argparse.ArgumentParser("Create TrueSkill ratings from game data.")
-    parser.add_argument("game_files", nargs="+",
-            help="Json files containing game data.")
+    utility.add_game_args(parser)
     parser.add_argument("-d", "--display", type=int, default=40,
             help="Limit display of rating to top N (0 for all)")
-    parser.add_argument("-n", "--num-games", type=int,
-            help="Limit the number of games used (positive for first, negative for last")
-    parser.add_argument("--remove-suspect", action="store_true",
-            help="Filter out suspect games based on workerID.")
-    parser.add_argument("--no-error", action="store_true",
-            help="Filter out games that had bot errors.")
     parser.add_argument("-o", "--out-file",
             help="If specified will write the full ratings to given filename")
     parser.add_argument("-t", "--tau", type=float,
             help="Set trueskill tau.")
     parser.add_argument("--draw-prob", type=float,
             help="Set trueskill draw probability.")
+    parser.add_argument("--checkpoint",
+            help="File to save rating state to while rating.")
+    parser.add_argument("--checkpoint-every", type=utility.positive_int,
+            default=10000,
+            help="Number of games between checkpoints.")
+    parser.add_argument("--resume", action="store_true",
+            help="Continue from the checkpoint, rating only later games.")
     config = parser.parse_args(args)
+    utility.check_game_args(parser, config)
 
-    games = utility.load_games(config.game_files)
-    if config.no_error:
-        games = utility.filter_error_games(games)
-        print("Filtered out error games, leaving %d" % (len(games),))
-    if config.remove_suspect:
-        start_num = len(games)
-        games = utility.filter_suspect_games(games)
-        print("Filtered out %d suspect games, leaving %d" % (
-            start_num - len(games), len(games)))
-
-    game_results = [{"%s (%s)" % (u['username'], u['userID']): int(u['rank'])
-        for u in g['users']}
-            for g in games]
-    if config.num_games:
-        if config.num_games > 0:
-            game_results = game_results[:config.num_games]
-            print("Using first %d games." % (len(game_results),))
-        else:
-            game_results = game_results[config.num_games:]
-            print("Using last %d games." % (len(game_results),))
+    try:
+        game_results, game_ids = utility.load_results(config)
+    except utility.ManifestError as err:
+        parser.error(str(err))
 
     if config.tau is not None:
         trueskill.global_env().tau = config.tau
@@ -75,7 +85,19 @@ def main(args=sys.argv[1:]):
         print("Using draw probability %g" % (
             trueskill.global_env().draw_probability,))
 
-    ratings = ts_ratings(game_results)
+    rater = TSRater()
+    if config.resume:
+        if not config.checkpoint:
+            print("Resuming requires a --checkpoint file.")
+            return
+        try:
+            game_results, game_ids = utility.resume_games(rater,
+                    config.checkpoint, game_results, game_ids)
+        except ValueError as err:
+            print("Can not resume: %s" % (err,))
+            return
+    ratings = utility.rate_games(rater, game_results, game_ids,
+            config.checkpoint, config.checkpoint_every)
 
     ratings = sorted(ratings.items(), key=lambda x: -(x[1].mu - (x[1].sigma*3)))
 
@@ -1,9 +1,23 @@
+import argparse
+import bisect
+import hashlib
+import heapq
 import json
+import os
+import struct
+import sys
+import weakref
+from array import array
+from collections import namedtuple
 
 def load_games(filenames):
     games = list()
     for filename in filenames:
         print("Reading %s" % (filename,))
+        if os.path.isdir(filename):
+            from game_log import GameLog
+            games += GameLog(filename).games()
+            continue
         with open(filename) as gfile:
             games += json.load(gfile)
     gids = set()
@@ -17,7 +31,213 @@ def load_games(filenames):
     print("%d games loaded." % (len(games),))
     return games
 
+def _parse_store(filename):
+    """Pool worker reading one game file into a GameStore."""
+    if os.path.isdir(filename):
+        from game_log import GameLog
+        return GameStore.from_games(GameLog(filename).games())
+    with open(filename) as gfile:
+        return GameStore.from_games(json.load(gfile))
+
+def merge_stores(stores):
+    """Merge stores of single game files into one holding the first copy of
+    each game in gameID order. Players are interned in the order they are
+    met, so the result is the same as GameStore.from_games(load_games(...))
+    on the files."""
+    seen = set()
+    entries = list()
+    for store in stores:
+        for gix, gid in enumerate(store.game_ids):
+            if gid not in seen:
+                seen.add(gid)
+                entries.append((gid, store, gix))
+    entries.sort(key=lambda e: e[0])
+    merged = GameStore()
+    remaps = {id(store): [None] * len(store.names) for store in stores}
+    for gid, store, gix in entries:
+        remap = remaps[id(store)]
+        start, end = store.offsets[gix], store.offsets[gix+1]
+        for pix in store.players[start:end]:
+            mpix = remap[pix]
+            if mpix is None:
+                mpix = remap[pix] = merged.intern(store.names[pix])
+            merged.players.append(mpix)
+        merged.ranks.extend(store.ranks[start:end])
+        merged.game_ids.append(gid)
+        merged.worker_ids.append(store.worker_ids[gix])
+        merged.errors.append(store.errors[gix])
+        merged.offsets.append(len(merged.players))
+    return merged
+
+def load_store(filenames, jobs=1, store_file=None):
+    """GameStore of the games in filenames, parsing up to jobs files at
+    once in worker processes.
+
+    If store_file is given the store and its player index are saved there
+    and reused until any of the game files change.
+    """
+    if store_file:
+        sources = [[os.path.abspath(f), os.stat(f).st_size,
+            os.stat(f).st_mtime_ns] for f in filenames]
+        if (os.path.exists(store_file)
+                and GameStore.read_header(store_file)['sources'] == sources):
+            store = GameStore.load(store_file)
+            print("%d games loaded from %s" % (len(store), store_file))
+            return store
+    jobs = min(jobs, len(filenames))
+    if jobs <= 1:
+        store = GameStore.from_games(load_games(filenames))
+    else:
+        import multiprocessing
+        print("Reading %d files with %d processes" % (len(filenames), jobs))
+        with multiprocessing.Pool(jobs) as pool:
+            stores = pool.map(_parse_store, filenames, chunksize=1)
+        store = merge_stores(stores)
+        print("%d games loaded." % (len(store),))
+    if store_file:
+        store.save(store_file, sources)
+        print("Saved games to %s" % (store_file,))
+    return store
+
+def add_game_args(parser):
+    """Add the arguments used by load_results to parser."""
+    parser.add_argument("game_files", nargs="+",
+            help="Json files containing game data, or game log directories.")
+    parser.add_argument("-n", "--num-games", type=int,
+            help="Limit the number of games used (positive for first, negative for last")
+    parser.add_argument("--remove-suspect", action="store_true",
+            help="Filter out suspect games based on workerID.")
+    parser.add_argument("--no-error", action="store_true",
+            help="Filter out games that had bot errors.")
+    parser.add_argument("--manifest",
+            help="Partition manifest to select a set of games from.")
+    parser.add_argument("--set",
+            help="Name of the manifest set to use (e.g. training or test).")
+    parser.add_argument("--load-jobs", type=int, default=1,
+            help="Number of processes parsing game files.")
+    parser.add_argument("--store",
+            help="File to save the parsed games and player index in, reused while the game files are unchanged.")
+
+def check_game_args(parser, config):
+    """Report add_game_args arguments that can not be used together."""
+    if config.manifest and not config.set:
+        parser.error("--manifest requires --set to choose one of its sets")
+
+def load_results(config, excluded_players=(), min_players=1, players=None,
+        store=None):
+    """Load and filter games as given by the add_game_args arguments.
+
+    Returns the list of game results, each a dictionary of player to rank,
+    and a matching list of gameIDs. Excluded players are removed from the
+    results and games left with fewer than min_players are dropped. If
+    players is given only the games including one of them are returned,
+    found with the player index when --num-games is not limiting the games.
+    A store already loaded from the game files may be given to use instead
+    of loading them again.
+    """
+    if players is not None and config.num_games:
+        game_results, game_ids = load_results(config, excluded_players,
+                min_players, store=store)
+        players = set(players)
+        keep = [gnum for gnum, result in enumerate(game_results)
+                if not players.isdisjoint(result)]
+        return [game_results[g] for g in keep], [game_ids[g] for g in keep]
+    if (store is not None or config.load_jobs > 1 or config.store
+            or players is not None):
+        if store is None:
+            store = load_store(config.game_files, config.load_jobs,
+                    config.store)
+        game_results, game_ids = store_results(store, config,
+                excluded_players, min_players, players)
+        return limit_games(config, game_results, game_ids)
+
+    games = load_games(config.game_files)
+    if config.manifest:
+        manifest = load_manifest(config.manifest)
+        games = manifest_games(games, manifest, config.set)
+        print("Using %d games from set %s" % (len(games), config.set))
+    if config.no_error:
+        games = filter_error_games(games)
+        print("Filtered out error games, leaving %d" % (len(games),))
+    if config.remove_suspect:
+        start_num = len(games)
+        games = filter_suspect_games(games)
+        print("Filtered out %d suspect games, leaving %d" % (
+            start_num - len(games), len(games)))
+
+    excluded_players = set(excluded_players)
+    game_results = list()
+    game_ids = list()
+    for g in games:
+        result = {result_name(u): int(u['rank']) for u in g['users']
+                if u['username'] not in excluded_players}
+        if len(result) >= min_players:
+            game_results.append(result)
+            game_ids.append(int(g['gameID']))
+    return limit_games(config, game_results, game_ids)
+
+def store_results(store, config, excluded_players=(), min_players=1,
+        players=None):
+    """load_results for games already in a GameStore."""
+    view = store.view()
+    if config.manifest:
+        manifest = load_manifest(config.manifest)
+        views = manifest_views(manifest, store)
+        check_manifest_set(manifest, config.set)
+        view = views[config.set]
+        print("Using %d games from set %s" % (len(view), config.set))
+    if players is not None:
+        view = view.with_players(players)
+        print("Using %d games with the %d given players" % (len(view),
+            len(set(players))))
+    indices = view.indices
+    errors = store.errors
+    if config.no_error:
+        indices = [gix for gix in indices if not errors[gix]]
+        print("Filtered out error games, leaving %d" % (len(indices),))
+    if config.remove_suspect:
+        start_num = len(indices)
+        worker_ids = store.worker_ids
+        indices = [gix for gix in indices if not errors[gix]
+                or 0 <= worker_ids[gix] <= SUSPECT_WORKER_CUTOFF]
+        print("Filtered out %d suspect games, leaving %d" % (
+            start_num - len(indices), len(indices)))
+
+    excluded_players = set(excluded_players)
+    excluded = set(pix for pix, name in enumerate(store.names)
+            if name.rsplit(" (", 1)[0] in excluded_players)
+    names = store.names
+    players = None if players is None else set(players)
+    game_results = list()
+    game_ids = list()
+    for gix in indices:
+        start, end = store.offsets[gix], store.offsets[gix+1]
+        result = {names[p]: r for p, r in
+                zip(store.players[start:end], store.ranks[start:end])
+                if p not in excluded}
+        if players is not None and players.isdisjoint(result):
+            continue
+        if len(result) >= min_players:
+            game_results.append(result)
+            game_ids.append(store.game_ids[gix])
+    return game_results, game_ids
+
+def limit_games(config, game_results, game_ids):
+    """Apply the --num-games limit."""
+    if config.num_games:
+        if config.num_games > 0:
+            game_results = game_results[:config.num_games]
+            game_ids = game_ids[:config.num_games]
+            print("Using first %d games." % (len(game_results),))
+        else:
+            game_results = game_results[config.num_games:]
+            game_ids = game_ids[config.num_games:]
+            print("Using last %d games." % (len(game_results),))
+    return game_results, game_ids
+
 def filter_in_players(games, players):
+    if isinstance(games, GameView):
+        return games.with_players(players)
     keep_players = set(players)
     filtered = list()
     for game in games:
@@ -35,8 +255,11 @@ def filter_out_players(games, players):
             filtered.append(game)
     return filtered
 
+# Games with errors from workers above this, or unknown, workers are suspect
+SUSPECT_WORKER_CUTOFF = 160
+
 def filter_suspect_games(games):
-    worker_cutoff = 160
+    worker_cutoff = SUSPECT_WORKER_CUTOFF
     filtered = list()
     for game in games:
         if game['workerID'] is None or int(game['workerID']) > worker_cutoff:
@@ -62,3 +285,644 @@ def filter_error_games(games):
             continue
         filtered.append(game)
     return filtered
+
+def result_name(user):
+    return "%s (%s)" % (user['username'], user['userID'])
+
+def result_digest(game_id, result):
+    """Hash of a single game result, independent of user order."""
+    h = hashlib.sha256(str(int(game_id)).encode())
+    for name, rank in sorted(result.items()):
+        h.update(("|%s:%d" % (name, rank)).encode())
+    return int.from_bytes(h.digest(), 'big')
+
+def combine_digests(digests):
+    """Combine per game hashes into one, independent of game order."""
+    return "%064x" % (sum(digests) % (1 << 256),)
+
+def games_digest(games):
+    return combine_digests(result_digest(g['gameID'],
+        {result_name(u): int(u['rank']) for u in g['users']}) for g in games)
+
+def results_digest(game_results, game_ids):
+    """Digest of game results as returned by load_results."""
+    return combine_digests(result_digest(gid, result)
+            for gid, result in zip(game_ids, game_results))
+
+class GameStore:
+    """Compact storage of game results with interned player names.
+
+    The users of game i are players[offsets[i]:offsets[i+1]] with their
+    finishing ranks in the same slice of ranks. Games are expected to be
+    added in gameID order.
+    """
+    def __init__(self):
+        self.names = list()
+        self.name_ix = dict()
+        self.game_ids = array('q')
+        self.worker_ids = array('q')
+        self.errors = array('b')
+        self.offsets = array('q', [0])
+        self.players = array('i')
+        self.ranks = array('i')
+        self.player_offsets = None
+        self.player_games = None
+        self._gid_ix = None
+
+    @classmethod
+    def from_games(cls, games):
+        store = cls()
+        for game in games:
+            store.add_game(game)
+        return store
+
+    def intern(self, name):
+        pix = self.name_ix.get(name)
+        if pix is None:
+            pix = len(self.names)
+            self.names.append(name)
+            self.name_ix[name] = pix
+        return pix
+
+    def add_game(self, game):
+        self.game_ids.append(int(game['gameID']))
+        wid = game.get('workerID')
+        self.worker_ids.append(-1 if wid is None else int(wid))
+        had_error = False
+        for user in game['users']:
+            self.players.append(self.intern(result_name(user)))
+            self.ranks.append(int(user['rank']))
+            if user['errorLogName'] is not None:
+                had_error = True
+        self.errors.append(had_error)
+        self.offsets.append(len(self.players))
+        self._gid_ix = None
+        self.player_offsets = self.player_games = None
+
+    def __len__(self):
+        return len(self.game_ids)
+
+    def result(self, gix):
+        start, end = self.offsets[gix], self.offsets[gix+1]
+        names = self.names
+        return {names[p]: r for p, r in
+                zip(self.players[start:end], self.ranks[start:end])}
+
+    def game_index(self, game_id):
+        if self._gid_ix is None:
+            self._gid_ix = {gid: gix for gix, gid in enumerate(self.game_ids)}
+        return self._gid_ix[int(game_id)]
+
+    def view(self, indices=None):
+        return GameView(self, indices)
+
+    def digest(self):
+        return self.view().digest()
+
+    def build_player_index(self):
+        """Build the inverted index from players to the games they played.
+
+        The indices of the games player p is in are
+        player_games[player_offsets[p]:player_offsets[p+1]] in increasing
+        order. It is built once and kept until more games are added.
+        """
+        if self.player_offsets is not None:
+            return
+        counts = [0] * len(self.names)
+        for pix in self.players:
+            counts[pix] += 1
+        offsets = array('q', [0])
+        for count in counts:
+            offsets.append(offsets[-1] + count)
+        games = array('q', bytes(8 * len(self.players)))
+        fill = list(offsets[:-1])
+        store_offsets = self.offsets
+        players = self.players
+        for gix in range(len(self)):
+            for pix in players[store_offsets[gix]:store_offsets[gix+1]]:
+                games[fill[pix]] = gix
+                fill[pix] += 1
+        self.player_offsets = offsets
+        self.player_games = games
+
+    def games_of(self, player):
+        """Indices of the games a player, by name, is in."""
+        self.build_player_index()
+        pix = self.name_ix.get(player)
+        if pix is None:
+            return array('q')
+        return self.player_games[self.player_offsets[pix]:self.player_offsets[pix+1]]
+
+    def games_with(self, players):
+        """View of the games any of the players is in."""
+        indices = array('q')
+        for gix in heapq.merge(*(self.games_of(p) for p in set(players))):
+            if not indices or indices[-1] != gix:
+                indices.append(gix)
+        return self.view(indices)
+
+    def save(self, filename, sources=None):
+        """Write the store and its player index to filename, sources is
+        recorded to tell when the store is out of date."""
+        self.build_player_index()
+        arrays = STORE_ARRAYS + INDEX_ARRAYS
+        header = {
+                "byteorder": sys.byteorder,
+                "sources": sources,
+                "names": self.names,
+                "arrays": [(attr, getattr(self, attr).typecode,
+                    len(getattr(self, attr))) for attr in arrays],
+                }
+        tmp_name = filename + ".tmp"
+        with open(tmp_name, 'wb') as sfile:
+            sfile.write(json.dumps(header).encode() + b"\n")
+            for attr in arrays:
+                getattr(self, attr).tofile(sfile)
+        os.replace(tmp_name, filename)
+
+    @staticmethod
+    def read_header(filename):
+        with open(filename, 'rb') as sfile:
+            return json.loads(sfile.readline())
+
+    @classmethod
+    def load(cls, filename):
+        store = cls()
+        with open(filename, 'rb') as sfile:
+            header = json.loads(sfile.readline())
+            for attr, typecode, length in header['arrays']:
+                arr = array(typecode)
+                arr.fromfile(sfile, length)
+                if header['byteorder'] != sys.byteorder:
+                    arr.byteswap()
+                setattr(store, attr, arr)
+        store.names = header['names']
+        store.name_ix = {name: pix for pix, name in enumerate(store.names)}
+        return store
+
+class GameView:
+    """Sequence of game results for a subset of a GameStore.
+
+    Only the game indices are held, results are built from the store as
+    they are accessed.
+    """
+    def __init__(self, store, indices=None):
+        self.store = store
+        if indices is None:
+            indices = range(len(store))
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return GameView(self.store, self.indices[i])
+        return self.store.result(self.indices[i])
+
+    def __iter__(self):
+        result = self.store.result
+        for gix in self.indices:
+            yield result(gix)
+
+    def game_id(self, i):
+        return self.store.game_ids[self.indices[i]]
+
+    def with_players(self, players):
+        """View of the games in this view any of the players is in."""
+        found = self.store.games_with(players).indices
+        indices = self.indices
+        if isinstance(indices, range) and indices.step == 1:
+            keep = array('q', (gix for gix in found
+                if indices.start <= gix < indices.stop))
+        else:
+            in_view = set(indices)
+            keep = array('q', (gix for gix in found if gix in in_view))
+        return GameView(self.store, keep)
+
+    def digest(self):
+        game_ids = self.store.game_ids
+        return combine_digests(result_digest(game_ids[gix], self.store.result(gix))
+                for gix in self.indices)
+
+STORE_ARRAYS = ("game_ids", "worker_ids", "errors", "offsets", "players", "ranks")
+INDEX_ARRAYS = ("player_offsets", "player_games")
+
+StoreHandle = namedtuple("StoreHandle", ("name", "layout"))
+
+def _release_shared(shm):
+    shm.close()
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+class SharedGameStore:
+    """The arrays of a GameStore published in a shared memory segment.
+
+    handle is a small picklable description of the segment that other
+    processes pass to attach_store. The segment is unlinked by close, on
+    leaving a with block, when this object is garbage collected or at
+    interpreter exit. If the process dies without any of those the
+    multiprocessing resource tracker unlinks it.
+    """
+    def __init__(self, store):
+        from multiprocessing import shared_memory
+        names = "\0".join(store.names).encode()
+        layout = list()
+        size = 0
+        arrays = STORE_ARRAYS
+        if store.player_offsets is not None:
+            arrays += INDEX_ARRAYS
+        for attr in arrays:
+            arr = getattr(store, attr)
+            layout.append((attr, arr.typecode, size, len(arr)))
+            size += (len(arr) * arr.itemsize + 7) & ~7
+        layout.append(("names", "B", size, len(names)))
+        self.shm = shared_memory.SharedMemory(create=True,
+                size=max(size + len(names), 1))
+        self._finalizer = weakref.finalize(self, _release_shared, self.shm)
+        for attr, typecode, start, length in layout[:-1]:
+            data = memoryview(getattr(store, attr)).cast('B')
+            self.shm.buf[start:start + len(data)] = data
+        self.shm.buf[size:size + len(names)] = names
+        self.handle = StoreHandle(self.shm.name, tuple(layout))
+
+    def close(self):
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def attach_store(handle):
+    """Get a read only GameStore backed by a SharedGameStore segment."""
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=handle.name)
+    store = GameStore()
+    for attr, typecode, start, length in handle.layout:
+        view = shm.buf[start:start + length * struct.calcsize(typecode)]
+        if attr == "names":
+            store.names = bytes(view).decode().split("\0") if length else []
+        else:
+            setattr(store, attr, view.cast(typecode))
+    store.name_ix = {name: pix for pix, name in enumerate(store.names)}
+    store.shm = shm
+    return store
+
+def detach_store(store):
+    """Release a store from attach_store, it can not be used afterwards."""
+    for attr in STORE_ARRAYS + INDEX_ARRAYS:
+        if getattr(store, attr) is not None:
+            getattr(store, attr).release()
+    store.shm.close()
+
+# header entries every checkpoint written by save_checkpoint has
+CHECKPOINT_KEYS = ("system", "params", "last_game_id", "games_rated",
+        "byteorder", "players")
+
+class OnlineRater:
+    """Base for the online rating systems.
+
+    Each player's mu and sigma are kept in arrays indexed by the order the
+    players were first seen. Subclasses provide system, initial_rating,
+    rating, update and ratings.
+    """
+    system = None
+
+    def __init__(self):
+        self.names = list()
+        self.index = dict()
+        self.mu = array('d')
+        self.sigma = array('d')
+        self.last_game_id = None
+        self.games_rated = 0
+
+    def params(self):
+        """Settings that must match for a checkpoint to be resumed."""
+        return dict()
+
+    def player_index(self, player):
+        pix = self.index.get(player)
+        if pix is None:
+            mu, sigma = self.initial_rating(player)
+            pix = len(self.names)
+            self.names.append(player)
+            self.index[player] = pix
+            self.mu.append(mu)
+            self.sigma.append(sigma)
+        return pix
+
+    def save_checkpoint(self, filename):
+        header = {
+                "system": self.system,
+                "params": self.params(),
+                "last_game_id": self.last_game_id,
+                "games_rated": self.games_rated,
+                "byteorder": sys.byteorder,
+                "players": self.names,
+                }
+        tmp_name = filename + ".tmp"
+        with open(tmp_name, 'wb') as cfile:
+            cfile.write(json.dumps(header).encode() + b"\n")
+            self.mu.tofile(cfile)
+            self.sigma.tofile(cfile)
+        os.replace(tmp_name, filename)
+
+    def load_checkpoint(self, filename):
+        with open(filename, 'rb') as cfile:
+            try:
+                header = json.loads(cfile.readline())
+            except ValueError:
+                raise ValueError("%s is not a rating checkpoint" % (filename,))
+            missing = [key for key in CHECKPOINT_KEYS
+                    if not isinstance(header, dict) or key not in header]
+            if missing:
+                raise ValueError("Checkpoint %s is missing %s" % (filename,
+                    ", ".join(missing)))
+            if header['system'] != self.system:
+                raise ValueError("Checkpoint is for %s ratings not %s" % (
+                    header['system'], self.system))
+            if header['params'] != self.params():
+                raise ValueError("Checkpoint used different settings %s" % (
+                    header['params'],))
+            num_players = len(header['players'])
+            self.mu = array('d')
+            self.sigma = array('d')
+            try:
+                self.mu.fromfile(cfile, num_players)
+                self.sigma.fromfile(cfile, num_players)
+            except (EOFError, ValueError):
+                raise ValueError("Checkpoint %s is truncated" % (filename,))
+        if header['byteorder'] != sys.byteorder:
+            self.mu.byteswap()
+            self.sigma.byteswap()
+        self.names = header['players']
+        self.index = {name: pix for pix, name in enumerate(self.names)}
+        self.last_game_id = header['last_game_id']
+        self.games_rated = header['games_rated']
+
+def positive_int(value):
+    """argparse type for options that must be at least 1."""
+    value = int(value)
+    if value < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, not %d" % (value,))
+    return value
+
+def rate_games(rater, game_results, game_ids=None, checkpoint=None,
+        checkpoint_every=10000):
+    """Update rater with each game in turn.
+
+    If checkpoint is given the rater is saved there every checkpoint_every
+    games and after the last game, along with the last processed gameID.
+    """
+    if checkpoint and checkpoint_every < 1:
+        raise ValueError("checkpoint_every must be at least 1")
+    gnum = 0
+    for gnum, game in enumerate(game_results, start=1):
+        rater.update(game)
+        if game_ids is not None:
+            rater.last_game_id = int(game_ids[gnum - 1])
+        if checkpoint and gnum % checkpoint_every == 0:
+            rater.save_checkpoint(checkpoint)
+        if gnum % 10000 == 0:
+            print("\rRated %d games" % (gnum,), end="")
+    if gnum >= 10000:
+        print("\r", end="")
+    print("Rated %d games" % (gnum,))
+    if checkpoint:
+        rater.save_checkpoint(checkpoint)
+    return rater.ratings()
+
+def resume_games(rater, checkpoint, game_results, game_ids):
+    """Load a checkpoint into rater and drop the games it already rated."""
+    rater.load_checkpoint(checkpoint)
+    if rater.last_game_id is None:
+        raise ValueError("Checkpoint %s has no last gameID to resume from" % (
+            checkpoint,))
+    start = bisect.bisect_right(game_ids, rater.last_game_id)
+    print("Resuming from %d games rated up to game %d, %d games left" % (
+        rater.games_rated, rater.last_game_id, len(game_ids) - start))
+    return game_results[start:], game_ids[start:]
+
+def iter_games(filenames, chunk_size=1 << 20):
+    """Iterate over the games in json files, without loading whole files,
+    or game log directories."""
+    decoder = json.JSONDecoder()
+    for filename in filenames:
+        if os.path.isdir(filename):
+            from game_log import GameLog
+            yield from GameLog(filename).games()
+            continue
+        with open(filename) as gfile:
+            buf = gfile.read(chunk_size).lstrip()
+            if not buf.startswith("["):
+                raise ValueError("%s does not contain a list of games" % (filename,))
+            pos = 1
+            eof = False
+            while True:
+                while pos < len(buf) and buf[pos] in " \t\r\n,":
+                    pos += 1
+                if pos < len(buf) and buf[pos] == "]":
+                    break
+                try:
+                    game, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    more = gfile.read(chunk_size)
+                    eof = not more
+                    buf = buf[pos:] + more
+                    pos = 0
+                    continue
+                yield game
+                pos = end
+
+def hash_fraction(game_id, seed):
+    """Seeded pseudo random value in [0, 1) for a game."""
+    h = hashlib.blake2b(str(int(game_id)).encode(), digest_size=8,
+            key=str(seed).encode())
+    return int.from_bytes(h.digest(), 'big') / 2**64
+
+def build_manifest(filenames, kind, seed, bounds, dedup=False):
+    """Assign games to sets in a single pass over the game files.
+
+    bounds is a list of (set name, upper bound) pairs with increasing bounds
+    ending at 1, a game goes into the first set whose bound is above the
+    game's hash_fraction. Unless dedup is given, duplicate games in the input
+    are counted once for each copy.
+    """
+    manifest = {
+            "type": kind,
+            "seed": seed,
+            "bounds": bounds,
+            "counts": {name: 0 for name, bound in bounds},
+            }
+    assign = manifest_assigner(manifest)
+    seen = set() if dedup else None
+    digests = 0
+    for game in iter_games(filenames):
+        gid = int(game['gameID'])
+        if seen is not None:
+            if gid in seen:
+                continue
+            seen.add(gid)
+        manifest['counts'][assign(gid)] += 1
+        digests += result_digest(gid,
+                {result_name(u): int(u['rank']) for u in game['users']})
+    manifest['source'] = combine_digests([digests])
+    return manifest
+
+def write_manifest(filename, manifest):
+    with open(filename, 'w') as mfile:
+        json.dump(manifest, mfile, indent=2)
+
+class ManifestError(ValueError):
+    """A partition manifest that can not be used with the given games."""
+
+def load_manifest(filename):
+    try:
+        with open(filename) as mfile:
+            return json.load(mfile)
+    except (OSError, ValueError) as err:
+        raise ManifestError("Can not read manifest %s: %s" % (filename, err))
+
+def manifest_assigner(manifest):
+    """Get a function giving the name of the set a gameID belongs to."""
+    seed = manifest['seed']
+    names = [name for name, bound in manifest['bounds']]
+    bounds = [bound for name, bound in manifest['bounds']]
+    def assign(game_id):
+        return names[bisect.bisect_right(bounds, hash_fraction(game_id, seed))]
+    return assign
+
+def check_manifest_source(manifest, digest):
+    if digest != manifest['source']:
+        raise ManifestError("Games do not match those the manifest was made from."
+                " (Overlapping game files need a manifest made with --dedup)")
+
+def manifest_views(manifest, store):
+    """Get a view into store for each set in a partition manifest."""
+    check_manifest_source(manifest, store.digest())
+    assign = manifest_assigner(manifest)
+    indices = {name: array('q') for name, bound in manifest['bounds']}
+    for gix, gid in enumerate(store.game_ids):
+        indices[assign(gid)].append(gix)
+    return {name: store.view(ixs) for name, ixs in indices.items()}
+
+def check_manifest_set(manifest, set_name):
+    if set_name not in manifest['counts']:
+        raise ManifestError("Manifest has no set %s, available sets are %s" % (
+            set_name, ", ".join(sorted(manifest['counts']))))
+
+def manifest_games(games, manifest, set_name):
+    """Select the games in one set of a partition manifest."""
+    check_manifest_source(manifest, games_digest(games))
+    check_manifest_set(manifest, set_name)
+    assign = manifest_assigner(manifest)
+    return [g for g in games if assign(g['gameID']) == set_name]
+
+def add_cache_args(parser):
+    """Add the arguments used by open_cache to parser."""
+    parser.add_argument("--cache-dir",
+            help="Directory to cache ratings in, reused when the games and settings match.")
+    parser.add_argument("--cache-size", type=int, default=256,
+            help="Size in MB the rating cache is trimmed to. (Default 256)")
+
+def open_cache(config):
+    """RatingCache for the add_cache_args arguments, None if not enabled."""
+    if not config.cache_dir:
+        return None
+    return RatingCache(config.cache_dir, config.cache_size << 20)
+
+def filter_params(config, excluded_players=(), min_players=1):
+    """The load_results settings that decide which games are rated."""
+    return {
+            "num_games": config.num_games,
+            "remove_suspect": config.remove_suspect,
+            "no_error": config.no_error,
+            "set": config.set if config.manifest else None,
+            "excluded": sorted(excluded_players),
+            "min_players": min_players,
+            }
+
+CachedRating = namedtuple("CachedRating", ("mu", "sigma"))
+
+class RatingCache:
+    """Ratings saved on disk under a hash of everything that produced them.
+
+    Entries are keyed by the digest of the rated games, so the same games
+    from different files share an entry, along with the game filters, the
+    rating system and its parameters. Games are always rated in gameID
+    order, so the digest also fixes the order for the online systems.
+    Once the cache grows past max_bytes the least recently used entries are
+    removed. Ratings with a mu and sigma are returned as CachedRating.
+    """
+    def __init__(self, directory, max_bytes=256 << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(digest, system, params, filters=None):
+        desc = json.dumps({"games": digest, "system": system,
+            "params": params, "filters": filters}, sort_keys=True)
+        return hashlib.sha256(desc.encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        """Cached ratings for key or None."""
+        path = self.path(key)
+        try:
+            with open(path) as cfile:
+                ratings = json.load(cfile)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return {player: CachedRating(*value) if isinstance(value, list)
+                else value for player, value in ratings.items()}
+
+    def put(self, key, ratings):
+        data = {player: [value.mu, value.sigma] if hasattr(value, "mu")
+                else float(value) for player, value in ratings.items()}
+        path = self.path(key)
+        tmp_name = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_name, 'w') as cfile:
+            json.dump(data, cfile)
+        os.replace(tmp_name, path)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until under max_bytes."""
+        entries = list()
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def cached(self, key, rate):
+        """Cached ratings for key, calling rate and caching its result if
+        there are none."""
+        ratings = self.get(key)
+        if ratings is None:
+            ratings = rate()
+            self.put(key, ratings)
+        else:
+            print("Using cached ratings %s" % (key[:12],))
+        return ratings
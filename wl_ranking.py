@@ -21,13 +21,45 @@ paper and original code found at
 http://www.csie.ntu.edu.tw/~cjlin/papers/online_ranking/
 """
 
-def wl_bt_ratings(game_results, last_ratings=dict()):
-    """Weng-Lin Bradley-Terry Full Pair update rule ratings"""
-    players = list(set(p for game in game_results for p in game))
-    first = Rating(MU, SIGMA)
-    mu = {p: last_ratings.get(p, first).mu for p in players}
-    sigma = {p: last_ratings.get(p, first).sigma for p in players}
-    for gnum, game in enumerate(game_results, start=1):
+class WLRater(utility.OnlineRater):
+    """Weng-Lin ratings updated one game at a time."""
+    def __init__(self, last_ratings=dict()):
+        super().__init__()
+        self.last_ratings = last_ratings
+
+    def params(self):
+        return {"mu": MU, "sigma": SIGMA, "beta": BETA}
+
+    def initial_rating(self, player):
+        return self.last_ratings.get(player, Rating(MU, SIGMA))
+
+    def rating(self, player):
+        pix = self.index.get(player)
+        if pix is None:
+            return self.initial_rating(player)
+        return Rating(self.mu[pix], self.sigma[pix])
+
+    def update(self, game):
+        game = {self.player_index(p): r for p, r in game.items()}
+        omega, delta = self.game_updates(game)
+        mu = self.mu
+        sigma = self.sigma
+        for player in game:
+            mu[player] += omega[player]
+            sigma[player] *= math.sqrt(max(1 - delta[player], 0.0001))
+        self.games_rated += 1
+
+    def ratings(self):
+        return {name: Rating(mu, sigma)
+                for name, mu, sigma in zip(self.names, self.mu, self.sigma)}
+
+class WLBTRater(WLRater):
+    """Weng-Lin Bradley-Terry Full Pair update rule"""
+    system = "wl-bt"
+
+    def game_updates(self, game):
+        mu = self.mu
+        sigma = self.sigma
         omega = dict()
         delta = dict()
         for player, prank in game.items():
@@ -47,24 +79,15 @@ def wl_bt_ratings(game_results, last_ratings=dict()):
                 omega[player] += (sigma[player]**2 / ciq) * (s - piq)
                 gamma = sigma[player] / ciq
                 delta[player] += gamma * (sigma[player]**2 / ciq) / ciq * piq * (1 - piq)
-        for player in game:
-            mu[player] += omega[player]
-            sigma[player] *= math.sqrt(max(1 - delta[player], 0.0001))
-        if gnum % 10000 == 0:
-            print("\rRated %d games" % (gnum,), end="")
-    if gnum >= 10000:
-        print("\r", end="")
-    if gnum > 5000:
-        print("Rated %d games" % (gnum,))
-    return {player: Rating(mu[player], sigma[player]) for player in players}
+        return omega, delta
 
-def wl_pl_ratings(game_results, last_ratings=dict()):
-    """Weng-Lin Plackett-Luce update rule ratings"""
-    players = list(set(p for game in game_results for p in game))
-    first = Rating(MU, SIGMA)
-    mu = {p: last_ratings.get(p, first).mu for p in players}
-    sigma = {p: last_ratings.get(p, first).sigma for p in players}
-    for gnum, game in enumerate(game_results, start=1):
+class WLPLRater(WLRater):
+    """Weng-Lin Plackett-Luce update rule"""
+    system = "wl-pl"
+
+    def game_updates(self, game):
+        mu = self.mu
+        sigma = self.sigma
         c = math.sqrt(sum(sigma[p]**2 + BETA**2 for p in game))
         Aq = Counter(r for r in game.values())
         if Aq.most_common()[0][0] != 1:
@@ -89,61 +112,55 @@ def wl_pl_ratings(game_results, last_ratings=dict()):
                 etaq = (gamma * sigma[player]**2) / (c**2 * Aq[orank])
                 etaq *= PiCq * (1 - PiCq)
                 delta[player] += etaq
-        for player in game:
-            mu[player] += omega[player]
-            sigma[player] *= math.sqrt(max(1 - delta[player], 0.0001))
-        if gnum % 10000 == 0:
-            print("\rRated %d games" % (gnum,), end="")
-    if gnum >= 10000:
-        print("\r", end="")
-    if gnum > 5000:
-        print("Rated %d games" % (gnum,))
-    return {player: Rating(mu[player], sigma[player]) for player in players}
+        return omega, delta
+
+def wl_bt_ratings(game_results, last_ratings=dict()):
+    """Weng-Lin Bradley-Terry Full Pair update rule ratings"""
+    return utility.rate_games(WLBTRater(last_ratings), game_results)
+
+def wl_pl_ratings(game_results, last_ratings=dict()):
+    """Weng-Lin Plackett-Luce update rule ratings"""
+    return utility.rate_games(WLPLRater(last_ratings), game_results)
 
 def main(args=sys.argv[1:]):
     parser = argparse.ArgumentParser("Create Weng-Lin ratings from game data.")
-    parser.add_argument("game_files", nargs="+",
-            help="Json files containing game data.")
+    utility.add_game_args(parser)
     parser.add_argument("-d", "--display", type=int, default=40,
             help="Limit display of rating to top N (0 for all)")
-    parser.add_argument("-n", "--num-games", type=int,
-            help="Limit the number of games used (positive for first, negative for last")
-    parser.add_argument("--remove-suspect", action="store_true",
-            help="Filter out suspect games based on workerID.")
-    parser.add_argument("--no-error", action="store_true",
-            help="Filter out games that had bot errors.")
     parser.add_argument("-o", "--out-file",
             help="If specified will write the full ratings to given filename")
     parser.add_argument("--plackett-luce", action="store_true",
             help="Use Plackett-Luce update rule.")
+    parser.add_argument("--checkpoint",
+            help="File to save rating state to while rating.")
+    parser.add_argument("--checkpoint-every", type=utility.positive_int,
+            default=10000,
+            help="Number of games between checkpoints.")
+    parser.add_argument("--resume", action="store_true",
+            help="Continue from the checkpoint, rating only later games.")
     config = parser.parse_args(args)
+    utility.check_game_args(parser, config)
 
-    games = utility.load_games(config.game_files)
-    if config.no_error:
-        games = utility.filter_error_games(games)
-        print("Filtered out error games, leaving %d" % (len(games),))
-    if config.remove_suspect:
-        start_num = len(games)
-        games = utility.filter_suspect_games(games)
-        print("Filtered out %d suspect games, leaving %d" % (
-            start_num - len(games), len(games)))
-
-    game_results = [{"%s (%s)" % (u['username'], u['userID']): int(u['rank'])
-        for u in g['users']}
-            for g in games]
-    if config.num_games:
-        if config.num_games > 0:
-            game_results = game_results[:config.num_games]
-            print("Using first %d games." % (len(game_results),))
-        else:
-            game_results = game_results[config.num_games:]
-            print("Using last %d games." % (len(game_results),))
-
-    wl_ratings = wl_bt_ratings
-    if config.plackett_luce:
-        wl_ratings = wl_pl_ratings
+    try:
+        game_results, game_ids = utility.load_results(config)
+    except utility.ManifestError as err:
+        parser.error(str(err))
 
-    ratings = wl_ratings(game_results)
+    rater = WLBTRater()
+    if config.plackett_luce:
+        rater = WLPLRater()
+    if config.resume:
+        if not config.checkpoint:
+            print("Resuming requires a --checkpoint file.")
+            return
+        try:
+            game_results, game_ids = utility.resume_games(rater,
+                    config.checkpoint, game_results, game_ids)
+        except ValueError as err:
+            print("Can not resume: %s" % (err,))
+            return
+    ratings = utility.rate_games(rater, game_results, game_ids,
+            config.checkpoint, config.checkpoint_every)
 
     ratings = sorted(ratings.items(), key=lambda x: -(x[1].mu - (x[1].sigma*3)))
 